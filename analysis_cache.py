@@ -0,0 +1,115 @@
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any
+
+# Bump whenever what gets cached changes shape, so old entries aren't served anymore
+CACHE_VERSION = 1
+
+MISSING = object()
+
+
+class AnalysisCache:
+    """
+    Caches analysis results by the content of the analyzed file, so that reposted files aren't analyzed again.
+
+    Results are kept in memory up to memory_limit bytes (least recently used ones are dropped first) and, if a path is
+    given, in an SQLite database of up to disk_limit bytes that survives restarts. Values have to be JSON serializable.
+    """
+
+    def __init__(self, path: str | None = None, memory_limit: int = 4 * 1024 * 1024,
+                 disk_limit: int = 64 * 1024 * 1024):
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._memory: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+        self._memory_size = 0
+        # When entries read from the disk were last used, written with the next put instead of on every read
+        self._touched: dict[str, float] = {}
+        self._disk_size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS results "
+                             "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                             "last_used REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self._db.commit()
+            self._disk_size = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    @staticmethod
+    def key(kind: str, data: bytes) -> str:
+        """Returns the cache key for the result of analyzing data as the given kind of file."""
+        return f"{kind}:{CACHE_VERSION}:{hashlib.sha256(data).hexdigest()}"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Returns the cached value for the key, or default if there is none."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return self._memory[key][0]
+
+        if self._db is not None:
+            row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._touched[key] = time.time()
+                value = json.loads(row[0])
+                self._remember(key, value, len(row[0]))
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return default
+
+    def put(self, key: str, value: Any):
+        encoded = json.dumps(value)
+        self._remember(key, value, len(encoded))
+
+        if self._db is not None:
+            self._write_touched()
+            row = self._db.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._disk_size -= row[0]
+            self._db.execute("INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                             (key, encoded, len(encoded), time.time()))
+            self._disk_size += len(encoded)
+            self._evict_disk()
+            self._db.commit()
+
+    def _remember(self, key: str, value: Any, size: int):
+        if key in self._memory:
+            self._memory_size -= self._memory.pop(key)[1]
+
+        self._memory[key] = (value, size)
+        self._memory_size += size
+        while self._memory_size > self.memory_limit and len(self._memory) > 1:
+            _, (_, evicted_size) = self._memory.popitem(last=False)
+            self._memory_size -= evicted_size
+
+    def _write_touched(self):
+        if self._touched:
+            self._db.executemany("UPDATE results SET last_used = ? WHERE key = ?",
+                                 [(last_used, key) for key, last_used in self._touched.items()])
+            self._touched.clear()
+
+    def _evict_disk(self):
+        if self._disk_size <= self.disk_limit:
+            return
+
+        rows = self._db.execute("SELECT key, size FROM results ORDER BY last_used").fetchall()
+        for key, size in rows:
+            if self._disk_size <= self.disk_limit:
+                break
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._disk_size -= size
+
+    def close(self):
+        if self._db is not None:
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
@@ -0,0 +1,84 @@
+"""
+Detects the randomizer settings of many BPS seeds at once, like the bot does for uploaded patches.
+
+Usage: python ./analyze_seeds.py <directories, files or globs...> [--format jsonl|csv] [--group]
+"""
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+
+from base_rom import BaseRom
+from bps_analysis import analyze_bps_files, setting_names
+
+
+def find_patches(patterns: list[str]) -> list[str]:
+    """Returns every .bps file in the given directories, along with the files matching the given globs."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += sorted(glob.glob(os.path.join(glob.escape(pattern), "*.bps")))
+        else:
+            paths += sorted(glob.glob(pattern))
+    # The same file can be matched by more than one pattern
+    return list(dict.fromkeys(paths))
+
+
+def result_row(path: str, result: dict | None | Exception) -> dict:
+    if isinstance(result, Exception):
+        return {"file": path, "error": str(result)}
+    if result is None:
+        return {"file": path, "error": "not an MFOR patch"}
+    return {"file": path, "error": None, **result}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detects the randomizer settings of BPS seeds.")
+    parser.add_argument("patterns", nargs="+", help="directories of .bps files, .bps files or globs matching them")
+    parser.add_argument("--base-rom", default="metroid4.gba", help="the unmodified Metroid Fusion (U) ROM")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes, one per core by default")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    parser.add_argument("--group", action="store_true",
+                        help="list the seeds of each distinct combination of settings instead of every seed")
+    args = parser.parse_args()
+
+    paths = find_patches(args.patterns)
+    if not paths:
+        sys.exit("No .bps files found")
+    try:
+        base_rom = BaseRom(args.base_rom)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    if args.group:
+        columns = setting_names + ["count", "files"]
+    else:
+        columns = ["file", "error"] + setting_names
+    writer = csv.DictWriter(sys.stdout, columns) if args.format == "csv" else None
+    if writer is not None:
+        writer.writeheader()
+
+    def write(row: dict):
+        if writer is not None:
+            writer.writerow({key: ";".join(value) if isinstance(value, list) else value for key, value in row.items()})
+        else:
+            print(json.dumps(row))
+        sys.stdout.flush()
+
+    groups: dict[tuple, list[str]] = {}
+    for path, result in analyze_bps_files(base_rom, paths, args.workers):
+        if not args.group:
+            write(result_row(path, result))
+        elif isinstance(result, dict):
+            groups.setdefault(tuple(result[name] for name in setting_names), []).append(path)
+        else:
+            print(f"Skipping {path}: {result_row(path, result)["error"]}", file=sys.stderr)
+
+    for settings, files in sorted(groups.items(), key=lambda group: -len(group[1])):
+        write({**dict(zip(setting_names, settings)), "count": len(files), "files": sorted(files)})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import aiohttp
+import discord
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    """Raised for attachments over the size limit of their file type."""
+
+    def __init__(self, attachment: discord.Attachment, limit: int):
+        super().__init__(f"{attachment.filename} is {attachment.size} bytes, the limit is {limit}")
+        self.attachment = attachment
+        self.limit = limit
+
+
+class AttachmentFetcher:
+    """
+    Downloads attachments for all handlers. Attachments are checked against the size limit for their extension before
+    anything is downloaded, and again while streaming in case the reported size was wrong. Concurrent fetches of the
+    same attachment share one download, and at most max_in_flight bytes are downloaded at a time.
+    """
+
+    def __init__(self, size_limits: dict[str, int], max_in_flight: int):
+        self.size_limits = size_limits
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._in_flight_changed = asyncio.Condition()
+        self._downloads: dict[int, asyncio.Future[bytearray]] = {}
+        # Shared by every download so that connections to the CDN are reused, created on first use since it has to be
+        # created in the event loop
+        self._session: aiohttp.ClientSession | None = None
+
+    def size_limit(self, filename: str) -> int:
+        return self.size_limits.get(os.path.splitext(filename)[1].lower(), 0)
+
+    async def fetch(self, attachment: discord.Attachment) -> bytearray:
+        """Returns the content of the attachment. Raises AttachmentTooLarge if it's over its size limit."""
+        limit = self.size_limit(attachment.filename)
+        if attachment.size > limit:
+            raise AttachmentTooLarge(attachment, limit)
+
+        download = self._downloads.get(attachment.id)
+        if download is None:
+            download = asyncio.ensure_future(self._download(attachment, limit))
+            self._downloads[attachment.id] = download
+            download.add_done_callback(lambda _: self._downloads.pop(attachment.id, None))
+        # Shielded so that one cancelled fetch doesn't cancel the download for everyone else
+        return await asyncio.shield(download)
+
+    async def _download(self, attachment: discord.Attachment, limit: int) -> bytearray:
+        # A single attachment larger than the budget is still allowed through on its own
+        size = min(attachment.size, self.max_in_flight)
+        async with self._in_flight_changed:
+            await self._in_flight_changed.wait_for(lambda: self.in_flight + size <= self.max_in_flight)
+            self.in_flight += size
+
+        try:
+            if self._session is None:
+                self._session = aiohttp.ClientSession()
+            data = bytearray()
+            async with self._session.get(attachment.url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    data += chunk
+                    if len(data) > limit:
+                        raise AttachmentTooLarge(attachment, limit)
+            return data
+        finally:
+            async with self._in_flight_changed:
+                self.in_flight -= size
+                self._in_flight_changed.notify_all()
+
+    async def close(self):
+        """Closes the connections kept open for downloads."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,83 @@
+import copy
+import hashlib
+import os
+from zlib import crc32
+
+from mars_patcher.patching import BpsDecoder
+from mars_patcher.rom import Rom
+
+from sparse_bps import SparseBpsTarget
+from watched_file import WatchedFile
+
+# MD5 of Metroid Fusion (U), the only version MFOR patches are made against
+VANILLA_ROM_MD5 = "af5040fc0f579800151ee2a683e2e5b5"
+
+
+class BaseRom(WatchedFile):
+    """
+    Keeps the vanilla ROM in memory so that patch jobs don't have to read it from disk every time.
+    The file is validated once when loaded, and reloaded if it changes on disk. expected_md5 can be set to None to
+    accept any ROM, like the generated stand-ins the benchmarks use.
+    """
+
+    description = "base ROM"
+
+    def __init__(self, path: str | os.PathLike[str], expected_md5: str | None = VANILLA_ROM_MD5):
+        super().__init__(path)
+        self.expected_md5 = expected_md5
+        self._rom: Rom | None = None
+        self._data = b""
+        self.crc32 = 0
+        self.reload()
+
+    def load(self):
+        """
+        Loads and validates the ROM. Raises a ValueError with a readable message if it's missing or not a
+        vanilla Metroid Fusion (U) ROM.
+        """
+        try:
+            rom = Rom(self.path)
+        except FileNotFoundError:
+            raise ValueError(f"Base ROM {self.path} is missing, place a copy of Metroid Fusion (U) there")
+        except ValueError as e:
+            raise ValueError(f"Base ROM {self.path} is not usable: {e}")
+
+        data = bytes(rom.data)
+        md5 = hashlib.md5(data).hexdigest()
+        if self.expected_md5 is not None and md5 != self.expected_md5:
+            raise ValueError(f"Base ROM {self.path} has MD5 {md5}, expected an unmodified Metroid Fusion (U) "
+                             f"with MD5 {self.expected_md5}")
+
+        rom.data = data
+        self._rom = rom
+        self._data = data
+        self.crc32 = crc32(data)
+
+    @property
+    def view(self) -> memoryview:
+        """A read-only view of the vanilla ROM data. No copy is made."""
+        self._reload_if_changed()
+        return memoryview(self._data)
+
+    def new_rom(self, data) -> Rom:
+        """Returns a Rom with the same game and region as the base ROM, backed by the given data."""
+        self._reload_if_changed()
+        rom = copy.copy(self._rom)
+        rom.data = data
+        return rom
+
+    def apply_bps(self, patch: bytes, sparse: bool = True) -> Rom:
+        """
+        Applies a BPS patch on top of the base ROM and returns the patched ROM.
+        If sparse is set, the patched ROM only resolves the bytes that are actually read instead of building all of
+        them. Patches that can't be read that way are applied in full instead.
+        """
+        source = self.view
+        if sparse:
+            try:
+                return self.new_rom(SparseBpsTarget(patch, source, self.crc32))
+            except ValueError:
+                # The full decoder gives the proper error, or handles whatever the sparse one couldn't
+                pass
+
+        return self.new_rom(BpsDecoder().apply_patch(patch, source))
@@ -0,0 +1,928 @@
+"""
+Micro-benchmarks for the bot's hot paths. They run without Discord or a real ROM, using a generated stand-in for
+metroid4.gba instead.
+
+The replay benchmark runs fake messages, commands and reactions through the bot's actual handlers, and flags results
+that are notably worse than the baseline saved with --save-baseline.
+
+Usage: python ./benchmark.py [benchmark names...] [--save-baseline]
+"""
+import argparse
+import asyncio
+import contextlib
+import copy
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import resource
+import tempfile
+import time
+import timeit
+import tracemalloc
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from fractions import Fraction
+from typing import Any, AsyncIterator
+
+from aiohttp import web
+from discord.ext import commands
+from discord.state import ChunkRequest
+
+import mars_patcher.constants.game_data as mars_game_data
+from mars_patcher.connections import SHORTCUT_LEFT_DOORS, SHORTCUT_RIGHT_DOORS
+from mars_patcher.constants.main_hub_numbers import MAIN_HUB_ELE_DOORS
+from mars_patcher.patching import BpsDecoder
+from mars_patcher.rom import Rom, SIZE_8MB
+
+import bps_analysis
+import cstrattyw
+import nso
+from base_rom import BaseRom
+from bps_analysis import major_locations, major_offsets
+from enemies import EnemyIndex
+from metrics import Metrics
+from role_reactions import RoleUpdateQueue
+from sparse_bps import SOURCE_COPY, SOURCE_READ, TARGET_COPY, TARGET_READ, SparseBpsTarget
+from strats import Strat, StratCatalog
+from xdrop import XDropSimulator
+
+
+def make_stand_in_rom(seed: int = 0) -> bytes:
+    """Returns random data that passes for a Metroid Fusion (U) ROM, with vanilla area connections."""
+    rng = random.Random(seed)
+    data = bytearray(rng.randbytes(SIZE_8MB))
+    data[0xA0:0xB0] = b"METROID4USA\0AMTE"
+
+    connections = [(0, room, area) for area, room in enumerate(MAIN_HUB_ELE_DOORS, start=1)]
+    connections += [(area, door, target) for area, (door, target) in
+                    enumerate(zip(SHORTCUT_LEFT_DOORS, bps_analysis.vanilla_left_tubes), start=1)]
+    connections += [(area, door, target) for area, (door, target) in
+                    enumerate(zip(SHORTCUT_RIGHT_DOORS, bps_analysis.vanilla_right_tubes), start=1)]
+    connections.append((255, 255, 255))
+    offset = 0x3C8B90
+    for connection in connections:
+        data[offset:offset + 3] = bytes(connection)
+        offset += 3
+    return bytes(data)
+
+
+def make_mfor_rom(source: bytes, seed: int) -> bytes:
+    """Returns a copy of source with randomized MFOR settings written over it."""
+    rng = random.Random(seed)
+    data = bytearray(source)
+    data[7657860:7657869] = b"RED DOORS"
+    for offset in major_offsets.values():
+        location = rng.choice(major_locations).encode("ascii") + b"\x00"
+        data[offset:offset + len(location)] = location
+    if rng.random() < 0.5:
+        data[bps_analysis.pb_offset] = 32
+    if rng.random() < 0.5:
+        data[bps_analysis.security_offset:bps_analysis.security_offset + 2] = b"\x00\x00"
+    if rng.random() < 0.5:
+        offset = 0x3C8B90
+        data[offset + 2], data[offset + 5] = data[offset + 5], data[offset + 2]
+    if rng.random() < 0.5:
+        data[bps_analysis.first_tileset_offset:bps_analysis.first_tileset_offset + 2] = b"\x00\x00"
+    # Some larger changes, so that the patch has a realistic amount of actions
+    for _ in range(200):
+        offset = rng.randrange(SIZE_8MB - 4096)
+        data[offset:offset + 4096] = rng.randbytes(4096)
+    # Data moved around, copied and filled with repeating patterns, which patches encode as copies
+    for _ in range(20):
+        offset = rng.randrange(SIZE_8MB - 4096)
+        moved_from = rng.randrange(SIZE_8MB - 4096)
+        data[offset:offset + 4096] = source[moved_from:moved_from + 4096]
+    for _ in range(20):
+        offset = rng.randrange(SIZE_8MB // 2, SIZE_8MB - 4096)
+        copied_from = rng.randrange(SIZE_8MB // 2 - 4096)
+        data[offset:offset + 4096] = data[copied_from:copied_from + 4096]
+    for _ in range(20):
+        offset = rng.randrange(SIZE_8MB - 4096)
+        data[offset:offset + 4096] = (rng.randbytes(rng.randint(1, 8)) * 4096)[:4096]
+    return bytes(data)
+
+
+# Changed runs shorter than this are always target reads in generated patches
+MIN_COPY_LENGTH = 32
+# The longest pattern that generated patches repeat with an overlapping target copy
+MAX_PATTERN_LENGTH = 16
+
+
+def _encode_int(num: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        x = num & 0x7F
+        num >>= 7
+        if num == 0:
+            encoded.append(0x80 | x)
+            return bytes(encoded)
+        encoded.append(x)
+        num -= 1
+
+
+def _encode_offset(offset: int) -> bytes:
+    return _encode_int(abs(offset) << 1 | (offset < 0))
+
+
+def make_bps(source: bytes, target: bytes) -> bytes:
+    """
+    Returns a BPS patch from source to target that uses every kind of action. Unchanged runs are source reads.
+    Changed runs are source copies if they're found in the source, target copies if they're found earlier in the
+    target or repeat a short pattern, and target reads otherwise.
+    """
+    patch = bytearray(b"BPS1") + _encode_int(len(source)) + _encode_int(len(target)) + _encode_int(0)
+    # Where the last source and target copies ended, which the next ones are relative to
+    source_offset = 0
+    target_offset = 0
+
+    def encode_changed(index: int, end: int):
+        nonlocal source_offset, target_offset
+        data = target[index:end]
+        if len(data) >= MIN_COPY_LENGTH:
+            found = source.find(data)
+            if found >= 0:
+                patch.extend(_encode_int((len(data) - 1) << 2 | SOURCE_COPY) + _encode_offset(found - source_offset))
+                source_offset = found + len(data)
+                return
+            found = target.find(data, 0, index)
+            if found >= 0:
+                patch.extend(_encode_int((len(data) - 1) << 2 | TARGET_COPY) + _encode_offset(found - target_offset))
+                target_offset = found + len(data)
+                return
+            for period in range(1, MAX_PATTERN_LENGTH + 1):
+                if data[period:] == data[:-period]:
+                    # The copy starts reading what it writes itself, which repeats the first period bytes
+                    patch.extend(_encode_int((period - 1) << 2 | TARGET_READ) + data[:period])
+                    patch.extend(_encode_int((len(data) - period - 1) << 2 | TARGET_COPY)
+                                 + _encode_offset(index - target_offset))
+                    target_offset = end - period
+                    return
+        patch.extend(_encode_int((len(data) - 1) << 2 | TARGET_READ) + data)
+
+    index = 0
+    while index < len(target):
+        end = index
+        if source[index] == target[index]:
+            while end < len(target) and source[end] == target[end]:
+                end += 1
+            patch += _encode_int((end - index - 1) << 2 | SOURCE_READ)
+        else:
+            while end < len(target) and source[end] != target[end]:
+                end += 1
+            encode_changed(index, end)
+        index = end
+    patch += zlib.crc32(source).to_bytes(4, "little") + zlib.crc32(target).to_bytes(4, "little")
+    patch += zlib.crc32(patch).to_bytes(4, "little")
+    return bytes(patch)
+
+
+def load_rom(data: bytes) -> Rom:
+    with tempfile.NamedTemporaryFile(suffix=".gba") as f:
+        f.write(data)
+        f.flush()
+        return Rom(f.name)
+
+
+def legacy_analyze_bps_rom(rom: Rom) -> dict | None:
+    """The hand written checks that bps_analysis.settings_probes replaced, kept to compare against."""
+    if rom.read_ascii(7657860, 9) != "RED DOORS":
+        # Not mfor
+        return None
+
+    # Prepare offsets and data
+    hidden_data_offset = 3926048
+    security_offset = 479192
+    pb_offsets = (24756, 24756)
+    sax_offset = 395796
+    box_offset = 8326096
+    varia_core_offset = 8326260
+    missile_data_offsets = (24828, sax_offset + 1, 465582, box_offset + 13, box_offset + 21, box_offset + 29,
+                            varia_core_offset + 13, varia_core_offset + 21, varia_core_offset + 29)
+
+    source_area = 0
+    start_address = mars_game_data.area_connections(rom)
+    area_connections = {}
+    while source_area != 255:
+        source_area = rom.read_8(start_address)
+        source_door = rom.read_8(start_address + 1)
+        target_area = rom.read_8(start_address + 2)
+        start_address += 3
+        area_connections[f"{source_area}-{source_door}"] = target_area
+
+    hidden_items = rom.read_bytes(hidden_data_offset, 24) == b"L\x00M\x00N\x00O\x00" * 3
+
+    is_major_minor_split = True
+    for major, offset in major_offsets.items():
+        last_read = b"\xFF"
+        chars = 0
+        while last_read != 0:
+            last_read = rom.read_8(offset + chars)
+            chars += 1
+        location = rom.read_ascii(offset, chars - 1).strip()
+        if location not in major_locations:
+            is_major_minor_split = False
+            break
+
+    missile_upgrades_give_data = "".join(
+        [str(rom.read_8(offset)) for offset in missile_data_offsets]) == "151515248248"
+    pb_without_bombs = rom.read_8(pb_offsets[0]) == rom.read_8(pb_offsets[1]) == 32
+    split_security = rom.read_16(security_offset) == 0
+
+    vanilla_elevators = True
+    for index, room in enumerate(MAIN_HUB_ELE_DOORS, start=1):
+        if area_connections[f"0-{room}"] != index:
+            vanilla_elevators = False
+            break
+
+    vanilla_left_tubes = [3, 1, 5, 2, 6, 4]
+    vanilla_right_tubes = [2, 4, 1, 6, 3, 5]
+    rom_left_tubes = [area_connections[f"{index}-{door}"] for index, door in
+                      enumerate(SHORTCUT_LEFT_DOORS, start=1)]
+    rom_right_tubes = [area_connections[f"{index}-{door}"] for index, door in
+                       enumerate(SHORTCUT_RIGHT_DOORS, start=1)]
+    vanilla_tubes = vanilla_left_tubes == rom_left_tubes and vanilla_right_tubes == rom_right_tubes
+
+    first_tileset_offset = 4219100
+    first_tileset_length = 8
+    first_tileset_data = b'\xe0B@\xff\xb3^%\xa1\xc2\x0b-\xc3\xe0\x03=\x08'
+    vanilla_tilesets = b"".join([rom.read_bytes(first_tileset_offset + index * 15, 2) for index in
+                                 range(first_tileset_length)]) == first_tileset_data
+
+    first_sprite_offset = 2835304
+    first_sprite_length = 8
+    first_sprite_data = b'\xc0B\x02\xff\x84\x13+\xed\xeec\x03\xf4\xf2K"\xfb'
+    vanilla_sprites = b"".join([rom.read_bytes(first_sprite_offset + index * 15, 2) for index in
+                                range(first_sprite_length)]) == first_sprite_data
+
+    first_suit_offset = 2678268
+    first_suit_length = 8
+    first_suit_data = b'\x84|S_\xf1G\x7f\x00\xe81S\xef\x00\x00%\x1f'
+    vanilla_suits = b"".join([rom.read_bytes(first_suit_offset + index * 15, 2) for index in
+                              range(first_suit_length)]) == first_suit_data
+
+    first_beams_offset = 5813348
+    first_beams_length = 9
+    first_beams_data = b'\x00\x00\x00\xff\xff\x7f\x7f\xff\xff\x1f\x1f\xfd\xfd\x02\x02??%'
+    vanilla_beams = b"".join([rom.read_bytes(first_beams_offset + index, 2) for index in
+                              range(first_beams_length)]) == first_beams_data
+
+    return {
+        "major_minor_split": is_major_minor_split,
+        "missile_upgrades_give_data": missile_upgrades_give_data,
+        "pb_without_bombs": pb_without_bombs,
+        "split_security": split_security,
+        "sector_shuffle": not vanilla_elevators,
+        "tube_shuffle": not vanilla_tubes,
+        "hidden_items": hidden_items,
+        "tileset_shuffle": not vanilla_tilesets,
+        "sprite_shuffle": not vanilla_sprites,
+        "suit_shuffle": not vanilla_suits,
+        "beam_shuffle": not vanilla_beams,
+    }
+
+
+def report(name: str, seconds: float, runs: int):
+    print(f"{name}: {seconds / runs * 1000:.3f} ms per run")
+
+
+def bench_bps_probes():
+    source = make_stand_in_rom()
+    template = load_rom(source)
+    for seed in range(4):
+        target = make_mfor_rom(source, seed)
+        patch = make_bps(source, target)
+        full = load_rom(target)
+        sparse = copy_rom(template, SparseBpsTarget(patch, source))
+
+        # The sparse target has to read every kind of action exactly like the full decoder applies it
+        sparse_target = SparseBpsTarget(patch, source)
+        assert {action for action, _ in sparse_target._actions} == {SOURCE_READ, TARGET_READ, SOURCE_COPY,
+                                                                     TARGET_COPY}, "the patch doesn't use every action"
+        decoded = BpsDecoder().apply_patch(patch, source)
+        assert decoded == target, "the full decoder doesn't rebuild the target"
+        assert sparse_target[:] == target, "the sparse target disagrees with the full decoder"
+        rng = random.Random(seed)
+        assert all(sparse_target[address] == decoded[address]
+                   for address in rng.sample(range(len(target)), 10000)), "a sparse read disagrees with the full decoder"
+
+        expected = legacy_analyze_bps_rom(full)
+        assert bps_analysis.analyze_bps_rom(full) == expected, "probe table disagrees with the legacy checks"
+        assert bps_analysis.analyze_bps_rom(sparse) == expected, "sparse ROM disagrees with the full one"
+
+    # Location names padded with whitespace still count, even when they're longer than any name
+    padded = bytearray(make_mfor_rom(source, 0))
+    longest = max(len(location) for location in major_locations)
+    for offset in major_offsets.values():
+        location = major_locations[0].ljust(longest + 8).encode("ascii") + b"\x00"
+        padded[offset:offset + len(location)] = location
+    padded_rom = load_rom(bytes(padded))
+    expected = legacy_analyze_bps_rom(padded_rom)
+    assert expected["major_minor_split"], "the legacy checks don't accept padded location names"
+    assert bps_analysis.analyze_bps_rom(padded_rom) == expected, "probe table disagrees on padded location names"
+
+    runs = 200
+    report("legacy checks, full ROM", timeit.timeit(lambda: legacy_analyze_bps_rom(full), number=runs), runs)
+    report("probe table, full ROM", timeit.timeit(lambda: bps_analysis.analyze_bps_rom(full), number=runs), runs)
+    report("legacy checks, sparse ROM", timeit.timeit(lambda: legacy_analyze_bps_rom(sparse), number=runs), runs)
+    report("probe table, sparse ROM", timeit.timeit(lambda: bps_analysis.analyze_bps_rom(sparse), number=runs), runs)
+
+
+def make_enemy_names(count: int, seed: int = 0) -> list[str]:
+    """Returns count distinct made up enemy names."""
+    rng = random.Random(seed)
+    syllables = [consonant + vowel for consonant in "bcdfghjklmnprstvwxyz" for vowel in "aeiou"]
+    names = set()
+    while len(names) < count:
+        words = ["".join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(rng.randint(1, 2))]
+        names.add(" ".join(words))
+    return sorted(names)
+
+
+def make_typo(name: str, rng: random.Random) -> str:
+    index = rng.randrange(len(name))
+    return name[:index] + name[index + 1:]
+
+
+def bench_enemy_search():
+    rng = random.Random(0)
+    for count in (100, 1000, 10000):
+        names = make_enemy_names(count)
+        enemies = {name: {"health": 1, "aliases": [name.replace(" ", "")]} for name in names}
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            json.dump(enemies, f)
+            f.flush()
+            index = EnemyIndex(f.name)
+
+        queries = [make_typo(rng.choice(names), rng) for _ in range(1000)]
+        queries += [name[:3] for name in rng.sample(names, 100)]
+        report(f"search over {count} enemies", timeit.timeit(lambda: [index.search(q) for q in queries], number=1),
+               len(queries))
+
+
+def copy_rom(template: Rom, data) -> Rom:
+    rom = copy.copy(template)
+    rom.data = data
+    return rom
+
+
+def bench_metrics_overhead():
+    runs = 100000
+    for enabled in (False, True):
+        metrics = Metrics(enabled)
+
+        def timed():
+            with metrics.timer("benchmark_seconds", handler="benchmark"):
+                pass
+
+        report(f"timer, metrics {'on' if enabled else 'off'}", timeit.timeit(timed, number=runs), runs)
+
+
+# Where bench_replay keeps its results to compare later runs against. Timings depend on the machine, so the file isn't
+# checked in.
+BASELINE_PATH = "benchmark_baselines.json"
+# How much worse than the baseline a result can be before it's reported as a regression
+REGRESSION_TOLERANCE = 0.25
+# The roles channel and the message in guild_config.json that the replayed reactions are on
+ROLES_CHANNEL_ID = 1411451852003868913
+ROLES_MESSAGE_ID = 1411497048553033769
+
+
+@dataclass
+class FakeUser:
+    id: int
+    name: str = "runner"
+    bot: bool = False
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+
+@dataclass
+class FakeRole:
+    id: int
+
+    def is_default(self) -> bool:
+        return False
+
+
+@dataclass
+class FakeMember(FakeUser):
+    guild: "FakeGuild | None" = None
+    roles: list[FakeRole] = field(default_factory=list)
+    edits: int = 0
+
+    def get_role(self, role_id: int) -> FakeRole | None:
+        return next((role for role in self.roles if role.id == role_id), None)
+
+    async def add_roles(self, *roles):
+        self.edits += 1
+        self.roles += [FakeRole(role.id) for role in roles if self.get_role(role.id) is None]
+
+    async def remove_roles(self, *roles):
+        self.edits += 1
+        removed = {role.id for role in roles}
+        self.roles = [role for role in self.roles if role.id not in removed]
+
+
+@dataclass
+class FakeGuild:
+    id: int
+    members: dict[int, FakeMember] = field(default_factory=dict)
+
+    def get_member(self, user_id: int) -> FakeMember | None:
+        return self.members.get(user_id)
+
+    async def fetch_member(self, user_id: int) -> FakeMember:
+        return self.members[user_id]
+
+    def get_emoji(self, emoji_id: int) -> str:
+        return f"<:emoji:{emoji_id}>"
+
+
+@dataclass
+class FakeChannel:
+    id: int
+    name: str
+    sent: list = field(default_factory=list)
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+@dataclass
+class FakeAttachment:
+    id: int
+    filename: str
+    size: int
+    url: str
+
+
+@dataclass
+class FakeMessage:
+    """Has just enough of discord.Message for the router, the handlers and command parsing."""
+    id: int
+    author: FakeUser
+    channel: FakeChannel
+    guild: FakeGuild
+    _state: Any
+    content: str = ""
+    attachments: list[FakeAttachment] = field(default_factory=list)
+    replies: list = field(default_factory=list)
+
+    async def reply(self, content=None, **kwargs) -> "FakeMessage":
+        self.replies.append((content, kwargs))
+        return FakeMessage(self.id + 1, self.author, self.channel, self.guild, self._state, content or "")
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+@dataclass
+class FakeReactionEvent:
+    channel_id: int
+    message_id: int
+    guild_id: int
+    user_id: int
+    emoji: str
+    member: FakeMember | None = None
+
+
+@dataclass
+class FakeContext:
+    sent: list = field(default_factory=list)
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+
+def make_spoiler_log(filler_locations: int, seed: int) -> bytes:
+    """Returns a made up MFOR spoiler log, with filler_locations extra entries ahead of the item order."""
+    rng = random.Random(seed)
+    spoiler = {
+        "MFOR Version": "1.0.0",
+        "Seed": seed,
+        "Settings": {"E-Tanks": 20, "Missile Tanks": 48, "Power Bomb Tanks": 32, "Major/Minor Split": True,
+                     "Sector Shuffle": rng.random() < 0.5, "Tube Shuffle": rng.random() < 0.5},
+        "Locations": {f"Location {index}": {"Item": f"Item {index}", "Requirements": [f"Req {index}"] * 4}
+                      for index in range(filler_locations)},
+        "Item order": {location: rng.choice(list(major_offsets)) for location in major_locations},
+    }
+    return json.dumps(spoiler, indent=2).encode("utf-8")
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    ordered = sorted(latencies)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+@contextlib.asynccontextmanager
+async def serve_files(files: dict[str, bytes]) -> AsyncIterator[str]:
+    """Serves files on a local port, so attachments go through the real fetcher. Yields the base URL."""
+    async def handle_file(request: web.Request) -> web.Response:
+        return web.Response(body=files[request.match_info["name"]])
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle_file)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    finally:
+        await runner.cleanup()
+
+
+@contextlib.asynccontextmanager
+async def replay_bot(base_rom: BaseRom, **options) -> AsyncIterator[tuple[commands.Bot, FakeGuild]]:
+    """
+    Creates the bot as run_bot would, but with a stub in place of the gateway: it's logged in as a fake user and only
+    knows one fake guild. Analysis results aren't cached on disk, so every run starts out cold.
+    """
+    client, close_resources = cstrattyw.create_bot(patch_workers=0, cache_path=None, item_order_path=":memory:",
+                                                   strat_catalog_path=":memory:", base_rom=base_rom, **options)
+    guild = FakeGuild(1)
+    client._connection.user = FakeUser(2, "cstrattyw", bot=True)
+    client.get_guild = lambda guild_id: guild if guild_id == guild.id else None
+    try:
+        yield client, guild
+    finally:
+        await close_resources()
+
+
+async def replay_bps(client: commands.Bot, guild: FakeGuild, base_url: str, patches: list[bytes]) -> list[float]:
+    author = FakeUser(3)
+    channel = FakeChannel(4, "randomizer")
+    latencies = []
+    for index, patch in enumerate(patches):
+        attachment = FakeAttachment(index, f"seed{index}.bps", len(patch), f"{base_url}/seed{index}.bps")
+        message = FakeMessage(1000 + index * 2, author, channel, guild, client._connection, "", [attachment])
+        start = time.perf_counter()
+        await client.on_message(message)
+        latencies.append(time.perf_counter() - start)
+        assert message.replies, "a BPS patch didn't get a reply"
+    return latencies
+
+
+async def replay_spoiler_logs(client: commands.Bot, guild: FakeGuild, base_url: str,
+                              names: list[str], sizes: dict[str, int]) -> list[float]:
+    author = FakeUser(3)
+    channel = FakeChannel(4, "randomizer")
+    latencies = []
+    for index, name in enumerate(names):
+        attachment = FakeAttachment(index, name, sizes[name], f"{base_url}/{name}")
+        message = FakeMessage(1000 + index * 2, author, channel, guild, client._connection, "", [attachment])
+        start = time.perf_counter()
+        await client.on_message(message)
+        latencies.append(time.perf_counter() - start)
+        assert message.replies, "a spoiler log didn't get a reply"
+    return latencies
+
+
+async def replay_hp(client: commands.Bot, queries: list[str]) -> list[float]:
+    hp = client.get_command("hp")
+    latencies = []
+    for query in queries:
+        ctx = FakeContext()
+        start = time.perf_counter()
+        await hp.callback(ctx, message=query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def replay_reactions(client: commands.Bot, guild: FakeGuild, events: int, members: int) -> list[float]:
+    rng = random.Random(0)
+    emojis = ["\U0001F3C1", "\U0001F4C5", "\U0001F3B2", "\U0001F3A4"]
+    for user_id in range(100, 100 + members):
+        guild.members[user_id] = FakeMember(user_id, guild=guild)
+
+    latencies = []
+    for _ in range(events):
+        member = guild.members[rng.randrange(100, 100 + members)]
+        add = rng.random() < 0.6
+        payload = FakeReactionEvent(ROLES_CHANNEL_ID, ROLES_MESSAGE_ID, guild.id, member.id, rng.choice(emojis),
+                                    member if add else None)
+        start = time.perf_counter()
+        if add:
+            await client.on_raw_reaction_add(payload)
+        else:
+            await client.on_raw_reaction_remove(payload)
+        latencies.append(time.perf_counter() - start)
+
+    # Let the role update queue apply what the burst asked for
+    await asyncio.sleep(RoleUpdateQueue().delay + 0.5)
+    assert any(member.edits for member in guild.members.values()), "the reactions didn't change any roles"
+    return latencies
+
+
+async def run_replay(scenario: str, base_rom: BaseRom, files: dict[str, bytes], patches: list[bytes],
+                     spoiler_sizes: dict[str, list[str]], queries: list[str]) -> list[float]:
+    async with replay_bot(base_rom) as (client, guild):
+        async with serve_files(files) as base_url:
+            if scenario == "bps":
+                return await replay_bps(client, guild, base_url, patches)
+            if scenario.startswith("spoiler_"):
+                sizes = {name: len(data) for name, data in files.items()}
+                return await replay_spoiler_logs(client, guild, base_url, spoiler_sizes[scenario], sizes)
+            if scenario == "hp":
+                return await replay_hp(client, queries)
+            if scenario == "reaction_burst":
+                return await replay_reactions(client, guild, 2000, 50)
+            raise ValueError(f"Unknown scenario {scenario}")
+
+
+def bench_replay(save_baseline: bool = False):
+    """
+    Replays fake messages, commands and reactions through the bot's real handlers, and compares throughput, latency
+    and peak memory with the stored baseline.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        source = make_stand_in_rom()
+        rom_path = os.path.join(directory, "stand_in.gba")
+        with open(rom_path, "wb") as f:
+            f.write(source)
+        base_rom = BaseRom(rom_path, expected_md5=None)
+
+        files = {}
+        patches = [make_bps(source, make_mfor_rom(source, seed)) for seed in range(6)]
+        for index, patch in enumerate(patches):
+            files[f"seed{index}.bps"] = patch
+        spoiler_sizes = {}
+        for scenario, filler in (("spoiler_small", 0), ("spoiler_medium", 1000), ("spoiler_large", 10000)):
+            names = []
+            for seed in range(20):
+                name = f"{scenario}{seed}.json"
+                files[name] = make_spoiler_log(filler, seed)
+                names.append(name)
+            spoiler_sizes[scenario] = names
+
+        rng = random.Random(0)
+        enemy_names = list(EnemyIndex("enemy_info.json").all())
+        queries = [rng.choice(enemy_names) for _ in range(2000)] + [make_typo(rng.choice(enemy_names), rng)
+                                                                    for _ in range(200)]
+
+        results = {}
+        for scenario in ("bps", "spoiler_small", "spoiler_medium", "spoiler_large", "hp", "reaction_burst"):
+            args = (scenario, base_rom, files, patches, spoiler_sizes, queries)
+            latencies = asyncio.run(run_replay(*args))
+            # Measured in a separate run, since tracing allocations slows everything down
+            tracemalloc.start()
+            asyncio.run(run_replay(*args))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[scenario] = {
+                "throughput": len(latencies) / sum(latencies),
+                "p50_ms": percentile(latencies, 0.5) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "peak_kib": peak / 1024,
+            }
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r") as f:
+            baseline = json.load(f)
+
+    for scenario, result in results.items():
+        print(f"{scenario}: {result["throughput"]:.1f} events/s, p50 {result["p50_ms"]:.3f} ms, "
+              f"p99 {result["p99_ms"]:.3f} ms, peak {result["peak_kib"]:.0f} KiB")
+        if scenario not in baseline:
+            continue
+        for key, value in result.items():
+            previous = baseline[scenario][key]
+            # Throughput regresses by going down, everything else by going up
+            change = previous / value - 1 if key == "throughput" else value / previous - 1
+            if change > REGRESSION_TOLERANCE:
+                print(f"  REGRESSION: {key} is {change:.0%} worse than the baseline ({value:.3f} vs {previous:.3f})")
+
+    if save_baseline:
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved the results to {BASELINE_PATH}")
+
+
+def make_user_payload(user_id: int) -> dict:
+    return {"id": str(user_id), "username": f"runner{user_id}", "discriminator": "0", "avatar": None,
+            "global_name": None}
+
+
+def make_member_payload(user_id: int) -> dict:
+    return {"user": make_user_payload(user_id), "roles": [], "joined_at": "2024-01-01T00:00:00+00:00",
+            "deaf": False, "mute": False, "flags": 0}
+
+
+def make_guild_payload(guild_id: int, member_count: int) -> dict:
+    """A GUILD_CREATE for a large guild, which like on Discord only comes with a few of its members."""
+    return {
+        "id": str(guild_id), "name": "Simulated Fusion Server", "member_count": member_count, "large": True,
+        "owner_id": "100", "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0,
+                                      "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(guild_id + index), "type": 0, "name": f"channel{index}", "position": index,
+                      "permission_overwrites": []} for index in range(1, 51)],
+        "members": [make_member_payload(100 + index) for index in range(100)],
+        "emojis": [], "stickers": [], "features": [], "threads": [], "voice_states": [], "presences": [],
+    }
+
+
+def make_message_payload(message_id: int, channel_id: int, guild_id: int, author_id: int) -> dict:
+    return {
+        "id": str(message_id), "channel_id": str(channel_id), "guild_id": str(guild_id),
+        "author": make_user_payload(author_id), "member": make_member_payload(author_id) | {"user": None},
+        "content": "Anyone got a route for 100%?", "timestamp": "2024-01-01T00:00:00+00:00",
+        "edited_timestamp": None, "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [],
+        "attachments": [], "embeds": [], "pinned": False, "type": 0,
+    }
+
+
+async def simulate_gateway(lean: bool, member_count: int, message_count: int) -> dict:
+    """
+    Feeds the bot what the gateway sends when it joins a large guild: the guild, its member list if the bot asks for
+    it, and a stream of messages. Returns how long that took and how much ended up cached.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        rom_path = os.path.join(directory, "stand_in.gba")
+        with open(rom_path, "wb") as f:
+            f.write(make_stand_in_rom())
+        base_rom = BaseRom(rom_path, expected_md5=None)
+
+        async with replay_bot(base_rom, lean=lean) as (client, _):
+            # Set when logging in otherwise, events can't be dispatched without it
+            client.loop = asyncio.get_running_loop()
+            state = client._connection
+            guild_id = 10 ** 17
+            start = time.perf_counter()
+            guild = state._add_guild_from_data(make_guild_payload(guild_id, member_count))
+
+            if state._guild_needs_chunking(guild):
+                # What state.chunker would ask the gateway for, answered in chunks of 1000 like Discord does
+                request = ChunkRequest(guild.id, 0, asyncio.get_running_loop(), state._get_guild,
+                                       cache=state.member_cache_flags.joined)
+                state._chunk_requests[request.nonce] = request
+                chunk_count = math.ceil(member_count / 1000)
+                for index in range(chunk_count):
+                    state.parse_guild_members_chunk({
+                        "guild_id": str(guild_id), "chunk_index": index, "chunk_count": chunk_count,
+                        "nonce": request.nonce,
+                        "members": [make_member_payload(user_id) for user_id in
+                                    range(100 + index * 1000, 100 + min((index + 1) * 1000, member_count))],
+                    })
+            startup = time.perf_counter() - start
+
+            for index in range(message_count):
+                state.parse_message_create(make_message_payload(guild_id + 1000 + index, guild_id + 1 + index % 50,
+                                                                guild_id, 100 + index % member_count))
+            # Let the bot's on_message handle them, like it would while running
+            await asyncio.gather(*(task for task in asyncio.all_tasks() if task is not asyncio.current_task()))
+
+            return {
+                "startup": startup,
+                "members": len(guild.members),
+                "messages": len(state._messages or ()),
+                "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+
+
+def run_gateway_simulation(lean: bool, member_count: int, message_count: int) -> dict:
+    return asyncio.run(simulate_gateway(lean, member_count, message_count))
+
+
+def bench_gateway():
+    member_count = 100000
+    for lean in (False, True):
+        # Every mode runs in a fresh process, so their peak memory use doesn't mix
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_gateway_simulation, lean, member_count, 5000).result()
+        print(f"{"lean" if lean else "default"} mode, {member_count} members: startup {result["startup"]:.2f} s, "
+              f"peak RSS {result["peak_rss_mib"]:.0f} MiB, {result["members"]} members and "
+              f"{result["messages"]} messages cached")
+
+
+def make_strats(count: int, seed: int = 0) -> list[Strat]:
+    """Returns count made up strats, named after made up tricks in the locations of the real game."""
+    rng = random.Random(seed)
+    tricks = ["shinespark", "skip", "clip", "wall jump", "damage boost", "bomb jump", "quick kill", "early",
+              "door lock", "speed", "ball spark", "screw", "wave", "ice", "plasma", "diffusion", "setup", "manip"]
+    names = make_enemy_names(200, seed)
+    categories = ["Any%", "100%", "Low%", "Randomizer"]
+    return [Strat(f"https://youtu.be/{index}", f"{rng.choice(names)} {" ".join(rng.sample(tricks, 2))}",
+                  rng.choice(major_locations), rng.choice(categories), f"runner{index % 300}")
+            for index in range(count)]
+
+
+def bench_strat_search():
+    for count in (1000, 10000, 50000):
+        catalog = StratCatalog(":memory:")
+        strats = make_strats(count)
+        catalog.add_backfilled(1, list(enumerate(strats)), count - 1, True)
+
+        rng = random.Random(0)
+        searches = [(rng.choice(strats).name.split()[0][:4], "", "") for _ in range(200)]
+        searches += [("skip", "", "") for _ in range(100)]
+        searches += [("shine", "sector 3", "any") for _ in range(100)]
+        report(f"search over {count} strats", timeit.timeit(lambda: [catalog.search(1, *search)
+                                                                     for search in searches], number=1),
+               len(searches))
+        catalog.close()
+
+
+def make_lss(segments: int, attempts: int, seed: int = 0) -> bytes:
+    """Returns a LiveSplit splits file with the given number of segments, each with a time for every attempt."""
+    rng = random.Random(seed)
+
+    def lss_time() -> str:
+        ticks = rng.randrange(10 ** 7, 600 * 10 ** 7)
+        return nso.format_time(ticks, nso.TICK_DIGITS)
+
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<Run version="1.7.0">', "<GameName>Metroid Fusion</GameName>",
+             "<AttemptHistory>"]
+    lines += [f'<Attempt id="{index}"><RealTime>{lss_time()}</RealTime></Attempt>' for index in range(1, attempts + 1)]
+    lines.append("</AttemptHistory><Segments>")
+    for segment in range(segments):
+        lines.append(f"<Segment><Name>Split {segment}</Name><SplitTimes><SplitTime name=\"Personal Best\">"
+                     f"<RealTime>{lss_time()}</RealTime></SplitTime></SplitTimes>"
+                     f"<BestSegmentTime><RealTime>{lss_time()}</RealTime></BestSegmentTime><SegmentHistory>")
+        lines += [f'<Time id="{index}"><RealTime>{lss_time()}</RealTime><GameTime>{lss_time()}</GameTime></Time>'
+                  for index in range(1, attempts + 1)]
+        lines.append("</SegmentHistory></Segment>")
+    lines.append("</Segments></Run>")
+    return "\n".join(lines).encode("utf-8")
+
+
+# Any time element of a splits file
+_lss_time_element = re.compile(r"<(RealTime|GameTime)>([^<]*)</\1>")
+
+
+def check_nso_conversion():
+    """Checks conversion and rounding against exact fractions, and that only the times in splits files change."""
+    rng = random.Random(0)
+    ticks = [0, 1, 5, 10 ** 7, 59 * 10 ** 7 + 9999999] + [rng.randrange(10 ** 12) for _ in range(10000)]
+    for value in ticks:
+        expected = math.floor(Fraction(value) * nso.NSO_FACTOR + Fraction(1, 2))
+        assert nso.to_original_hardware(value) == expected, f"{value} ticks aren't converted exactly"
+        for digits in (0, 2, 3, 7):
+            unit = 10 ** (nso.TICK_DIGITS - digits)
+            rounded = math.floor(Fraction(value, unit) + Fraction(1, 2)) * unit
+            text = nso.format_time(value, digits)
+            assert nso.parse_time(text) == (rounded, max(digits, 2)), f"{value} ticks aren't formatted as {text}"
+    assert nso.parse_time("1:2:3") == (3723 * 10 ** 7, 2), "times with single digits aren't accepted"
+
+    splits = make_lss(5, 20).decode("utf-8")
+    converted = nso.convert_lss(splits.encode("utf-8")).decode("utf-8")
+    assert _lss_time_element.sub(r"<\1/>", converted) == _lss_time_element.sub(r"<\1/>", splits), \
+        "something other than the times changed in the splits file"
+    for original, new in zip(_lss_time_element.finditer(splits), _lss_time_element.finditer(converted), strict=True):
+        expected = nso.format_time(nso.to_original_hardware(nso.parse_time(original[2])[0]), nso.TICK_DIGITS)
+        assert new[2] == expected, f"{original[2]} was converted to {new[2]} rather than {expected}"
+
+
+def bench_nso_lss():
+    check_nso_conversion()
+    # The last one is about as large as the bot accepts
+    for segments, attempts in ((20, 100), (30, 1000), (10, 5000), (10, 9500)):
+        splits = make_lss(segments, attempts)
+        report(f"converting {segments} segments with {attempts} attempts ({len(splits) // 1024} KiB)",
+               timeit.timeit(lambda: nso.convert_lss(splits), number=3), 3)
+
+
+def bench_xdrop():
+    simulator = XDropSimulator(EnemyIndex("enemy_info.json"), seed=0)
+    enemies = [enemy for enemy in simulator.enemy_index.all() if simulator.chances(enemy) is not None]
+    rng = random.Random(0)
+    for kinds, kills in ((1, 10), (5, 10), (20, 20), (3, 100)):
+        route = [(enemy, kills) for enemy in rng.sample(enemies, kinds)]
+        # The first run also works out the outcome tables, which are reused by every run after it
+        report(f"1,000,000 runs, {kinds} enemies killed {kills} times each, first run",
+               timeit.timeit(lambda: simulator.simulate(route), number=1), 1)
+        report(f"1,000,000 runs, {kinds} enemies killed {kills} times each",
+               timeit.timeit(lambda: simulator.simulate(route), number=3), 3)
+
+
+benchmarks = {
+    "bps_probes": bench_bps_probes,
+    "enemy_search": bench_enemy_search,
+    "metrics_overhead": bench_metrics_overhead,
+    "replay": bench_replay,
+    "gateway": bench_gateway,
+    "strat_search": bench_strat_search,
+    "nso_lss": bench_nso_lss,
+    "xdrop": bench_xdrop,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the benchmarks, or only the named ones.")
+    parser.add_argument("names", nargs="*", help=f"any of {", ".join(benchmarks)}")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"store the replay results in {BASELINE_PATH} to compare later runs against")
+    args = parser.parse_args()
+
+    for name in args.names or benchmarks:
+        print(f"== {name}")
+        if name == "replay":
+            bench_replay(args.save_baseline)
+        else:
+            benchmarks[name]()
@@ -0,0 +1,245 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator
+
+from mars_patcher.connections import SHORTCUT_LEFT_DOORS, SHORTCUT_RIGHT_DOORS
+from mars_patcher.constants.main_hub_numbers import MAIN_HUB_ELE_DOORS
+from mars_patcher.rom import Rom
+
+from base_rom import BaseRom
+from rom_probes import AreaConnectionsEqual, JoinedBytesEqual, Matches, ProbeTable, StridedMatches, StringsIn, \
+    U16Equals
+
+major_locations = [
+    # Bosses
+    "Arachnus",
+    "Yakuza",
+    "Ridley",
+    "Charge Core-X",
+    "Zazabi",
+    "Nettori",
+    "Wide Core-X",
+    "Serris",
+    "Nightmare",
+    "Mega Core-X",
+    "BOX-2",
+    # Data
+    "Main Deck : Data Room",
+    'Sector 2 : Data Room',
+    'Sector 3 : Data Room',
+    'Sector 4 : Data Room',
+    'Sector 5 : Data Room',
+    # E-tank
+    "Arachnus Room",
+    "Reactor Silo Hallway",
+    "Arachnus Alcove",
+    "Sector 1: Entry Hallway",
+    "Ridley Area E-Tank",
+    'Sector 1: Speed Ceiling',
+    "Sector 2: Zazabi Access",
+    "Sector 2: Nettori Owtches",
+    "Crumble City Upper Item",
+    "Sector 3: Sidehopper Hallway",
+    "Sector 3: Upper Nova Stairway",
+    "Sector 3: Shinespark Puzzle",
+    "Sector 4: Collapsed Ceiling",
+    "Sector 4: Crab Battle",
+    "Sector 5: E-Tank Mimic",
+    "Sector 5: Minifridge",
+    "Sector 5: Nightmare Drop",
+    "Sector 6: Power Bomb Wall",
+    "Sector 6: Bomb Chain Alcove",
+    "Sector 6: Pillar Highway",
+    # Security room
+    "Sector 2 : Security Room",
+    "Sector 3 : Security Room",
+    "Sector 5 : Security Room",
+    "Sector 4 : Security Room",
+]
+major_offsets = {
+    'ChargeBeam': 7655617,
+    'WideBeam': 7655725,
+    'PlasmaBeam': 7655833,
+    'WaveBeam': 7655941,
+    'IceBeam': 7656049,
+    'MainMissiles': 7656157,
+    'SuperMissileItem': 7656265,
+    'IceMissileItem': 7656373,
+    'DiffusionItem': 7656481,
+    'Bombs': 7656589,
+    'MainPowerBombs': 7656697,
+    'MorphBall': 7656805,
+    'HiJumpBoots': 7656913,
+    'SpeedBooster': 7657021,
+    'SpaceJump': 7657129,
+    'ScrewAttack': 7657237,
+    'VariaSuit': 7657345,
+    'GravitySuit': 7657453,
+    'GreenDoors': 7657561,
+    'BlueDoors': 7657669,
+    'YellowDoors': 7657777,
+    'RedDoors': 7657885,
+}
+# How far apart the major location names are, which is as long as one can be
+major_slot_length = 108
+
+hidden_data_offset = 3926048
+security_offset = 479192
+pb_offset = 24756
+sax_offset = 395796
+box_offset = 8326096
+varia_core_offset = 8326260
+missile_data_offsets = (24828, sax_offset + 1, 465582, box_offset + 13, box_offset + 21, box_offset + 29,
+                        varia_core_offset + 13, varia_core_offset + 21, varia_core_offset + 29)
+
+vanilla_left_tubes = (3, 1, 5, 2, 6, 4)
+vanilla_right_tubes = (2, 4, 1, 6, 3, 5)
+
+first_tileset_offset = 4219100
+first_tileset_data = b'\xe0B@\xff\xb3^%\xa1\xc2\x0b-\xc3\xe0\x03=\x08'
+first_sprite_offset = 2835304
+first_sprite_data = b'\xc0B\x02\xff\x84\x13+\xed\xeec\x03\xf4\xf2K"\xfb'
+first_suit_offset = 2678268
+first_suit_data = b'\x84|S_\xf1G\x7f\x00\xe81S\xef\x00\x00%\x1f'
+first_beams_offset = 5813348
+first_beams_data = b'\x00\x00\x00\xff\xff\x7f\x7f\xff\xff\x1f\x1f\xfd\xfd\x02\x02??%'
+
+# Every setting that can be detected, as (name, probe, negated). A setting is reported as the result of its probe,
+# or the opposite of it if negated is set.
+settings_probes = ProbeTable([
+    ("major_minor_split", StringsIn(tuple(major_offsets.values()), frozenset(major_locations), major_slot_length),
+     False),
+    ("missile_upgrades_give_data", JoinedBytesEqual(missile_data_offsets, "151515248248"), False),
+    ("pb_without_bombs", Matches(pb_offset, b"\x20"), False),
+    ("split_security", U16Equals(security_offset, 0), False),
+    ("sector_shuffle", AreaConnectionsEqual(tuple((0, room) for room in MAIN_HUB_ELE_DOORS),
+                                            tuple(range(1, len(MAIN_HUB_ELE_DOORS) + 1))), True),
+    ("tube_shuffle", AreaConnectionsEqual(
+        tuple(enumerate(SHORTCUT_LEFT_DOORS, start=1)) + tuple(enumerate(SHORTCUT_RIGHT_DOORS, start=1)),
+        vanilla_left_tubes + vanilla_right_tubes), True),
+    ("hidden_items", Matches(hidden_data_offset, b"L\x00M\x00N\x00O\x00" * 3), False),
+    ("tileset_shuffle", StridedMatches(first_tileset_offset, 15, 2, 8, first_tileset_data), True),
+    ("sprite_shuffle", StridedMatches(first_sprite_offset, 15, 2, 8, first_sprite_data), True),
+    ("suit_shuffle", StridedMatches(first_suit_offset, 15, 2, 8, first_suit_data), True),
+    ("beam_shuffle", StridedMatches(first_beams_offset, 1, 2, 9, first_beams_data), True),
+])
+setting_names = [name for name, _, _ in settings_probes.rows]
+
+
+def analyze_bps_rom(rom: Rom) -> dict | None:
+    """
+    Detects the randomizer settings of a patched ROM. Returns None if the ROM wasn't made by MFOR.
+    """
+    if rom.read_ascii(7657860, 9) != "RED DOORS":
+        # Not mfor
+        return None
+
+    return settings_probes.run(rom)
+
+
+def analyze_bps_patch(base_rom: BaseRom, patch: bytes) -> dict | None:
+    """Applies a BPS patch to the base ROM and detects its randomizer settings."""
+    return analyze_bps_rom(base_rom.apply_bps(patch))
+
+
+# Set by the pool initializer in every worker
+_worker_base_rom: BaseRom | None = None
+
+
+def _load_worker_base_rom(path: str, expected_md5: str | None):
+    global _worker_base_rom
+    _worker_base_rom = BaseRom(path, expected_md5)
+
+
+def _use_worker_base_rom(base_rom: BaseRom):
+    global _worker_base_rom
+    _worker_base_rom = base_rom
+
+
+def _analyze_in_worker(patch: bytes) -> dict | None:
+    return analyze_bps_patch(_worker_base_rom, patch)
+
+
+def _analyze_file_in_worker(path: str) -> dict | None:
+    # Read here rather than sent over from the parent, so patches only get loaded once a worker is ready for them
+    with open(path, "rb") as f:
+        return analyze_bps_patch(_worker_base_rom, f.read())
+
+
+def analyze_bps_files(base_rom: BaseRom, paths: list[str],
+                      workers: int | None = None) -> Iterator[tuple[str, dict | None | Exception]]:
+    """
+    Analyzes BPS files in a pool of workers processes (one per core by default), each of which loads the base ROM
+    once. Yields (path, result) as files finish, where result is the settings summary, None if it's not an MFOR
+    patch, or the error if the file couldn't be read or applied.
+    """
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_load_worker_base_rom,
+                             initargs=(base_rom.path, base_rom.expected_md5)) as executor:
+        futures = {executor.submit(_analyze_file_in_worker, path): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except (OSError, ValueError) as e:
+                yield futures[future], e
+
+
+class PatchPoolBusy(Exception):
+    """Raised when the patch pool already has as many jobs as it's allowed to hold."""
+
+
+class PatchPool:
+    """
+    Runs BPS analysis outside the event loop.
+
+    With workers > 0, jobs run in that many processes, each with its own copy of the base ROM. With workers == 0
+    they run on a single background thread instead, sharing the given base ROM.
+    At most workers + max_queued jobs are accepted at a time, further jobs are rejected with PatchPoolBusy.
+    """
+
+    def __init__(self, base_rom: BaseRom, workers: int, max_queued: int, timeout: float):
+        self.base_rom = base_rom
+        self.workers = workers
+        self.max_jobs = max(workers, 1) + max_queued
+        self.timeout = timeout
+        self.in_flight = 0
+        self._executor = self._create_executor()
+
+    def _create_executor(self) -> Executor:
+        if self.workers == 0:
+            return ThreadPoolExecutor(max_workers=1, initializer=_use_worker_base_rom, initargs=(self.base_rom,))
+
+        # Forking a process that's running an event loop and threads is unsafe, so always spawn
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_load_worker_base_rom,
+                                   initargs=(self.base_rom.path, self.base_rom.expected_md5))
+
+    def _job_done(self):
+        self.in_flight -= 1
+
+    async def analyze(self, patch: bytes) -> dict | None:
+        """
+        Analyzes a BPS patch in the pool and returns its settings summary, or None if it's not an MFOR patch.
+        Raises PatchPoolBusy if the pool is full and TimeoutError if the job takes longer than the timeout.
+        """
+        if self.in_flight >= self.max_jobs:
+            raise PatchPoolBusy()
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._executor.submit(_analyze_in_worker, patch)
+        except BrokenProcessPool:
+            # A worker died, start over with a fresh pool
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._create_executor()
+            future = self._executor.submit(_analyze_in_worker, patch)
+
+        # The slot is only freed once the worker is actually done, even if we stop waiting for it earlier
+        self.in_flight += 1
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._job_done))
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
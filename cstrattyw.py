@@ -1,18 +1,38 @@
+import asyncio
 import io
-import json
-from datetime import datetime, timedelta
-from typing import Mapping, Optional, List, Any
+import logging
+import os
+import re
+import time
+from typing import Mapping, Optional, List, Any, Callable
 
 import discord
-import mars_patcher.constants.game_data as mars_game_data
-from discord import Message, Interaction, User, RawReactionActionEvent, PartialEmoji
+from discord import app_commands
+from discord import Attachment, Message, Interaction, RawReactionActionEvent
 from discord.ext import commands
 from discord.ext.commands import Cog, Command
 from discord.ext.commands.context import Context
-from mars_patcher.connections import SHORTCUT_LEFT_DOORS, SHORTCUT_RIGHT_DOORS
-from mars_patcher.constants.main_hub_numbers import MAIN_HUB_ELE_DOORS
-from mars_patcher.patching import BpsDecoder
-from mars_patcher.rom import Rom
+
+from analysis_cache import AnalysisCache, MISSING
+from attachments import AttachmentFetcher, AttachmentTooLarge
+from base_rom import BaseRom
+from bps_analysis import PatchPool, PatchPoolBusy
+from enemies import EnemyIndex
+from guild_config import GuildConfigIndex
+from metrics import Metrics
+from nso import contains_time, convert_lss, convert_times_in_text, format_time, parse_time, to_original_hardware
+from role_reactions import RoleUpdateQueue
+from router import MessageRouter
+from spoiler_log import ItemOrderStore, summarize_spoiler_log
+from strats import Strat, StratCatalog, parse_strat_search
+from xdrop import XDropSimulator, describe_amounts, parse_route
+
+# Discord doesn't allow more embeds in a message
+MAX_EMBEDS = 10
+# How many strats from the strats channel history are written to the catalog at a time
+STRAT_BACKFILL_BATCH = 500
+
+log = logging.getLogger(__name__)
 
 
 class CustomHelpCommand(commands.HelpCommand):
@@ -30,14 +50,174 @@ class CustomHelpCommand(commands.HelpCommand):
         await channel.send(message)
 
 
-def run_bot(discord_token: str):
+class ItemOrderButton(discord.ui.DynamicItem[discord.ui.Button],
+                      template=r"mfor_item_order:(?P<mode>spoilered|revealed):(?P<position>\d+)"):
+    """
+    A button under a spoiler log reply that shows the item order of one of its spoiler logs. Clicks are handled by
+    custom_id, so the buttons keep working after a restart.
+    """
+
+    # Set when the bot starts
+    item_orders: ItemOrderStore | None = None
+
+    def __init__(self, spoilered: bool, position: int, label: str):
+        mode = "spoilered" if spoilered else "revealed"
+        super().__init__(discord.ui.Button(label=label, custom_id=f"mfor_item_order:{mode}:{position}"))
+        self.spoilered = spoilered
+        self.position = position
+
+    @classmethod
+    def for_spoiler_log(cls, spoilered: bool, position: int, count: int) -> "ItemOrderButton":
+        number = f" {position + 1}" if count > 1 else ""
+        return cls(spoilered, position, f"Show Item Order{number} ({"Spoilered" if spoilered else "Revealed"})")
+
+    @classmethod
+    async def from_custom_id(cls, interaction: Interaction, item: discord.ui.Button,
+                             match: re.Match[str]) -> "ItemOrderButton":
+        return cls(match["mode"] == "spoilered", int(match["position"]), item.label)
+
+    async def callback(self, interaction: Interaction):
+        pages = self.item_orders.get(interaction.message.id, self.position, self.spoilered)
+        if pages is None:
+            await interaction.response.send_message("The item order for this seed isn't available anymore.",
+                                                    ephemeral=True)
+            return
+
+        await interaction.response.send_message(pages[0])
+        for page in pages[1:]:
+            await interaction.followup.send(page)
+
+
+def bps_summary_embed(filename: str, summary: dict) -> discord.Embed:
+    embed = discord.Embed()
+    embed.colour = discord.Colour.blue()
+    embed.title = "MFOR BPS Patch File"
+    filename = filename.replace("_", " ")
+    embed.description = f"File `{filename}`"
+    logic_settings_header = f"**Logic Settings**"
+    logic_settings_text = (
+        f"Item pool: {"Limited major item locations" if summary["major_minor_split"] else "Major items anywhere"}\n"
+        f"Missile upgrades enable Missiles: {summary["missile_upgrades_give_data"]}\n"
+        f"Power Bombs without normal Bombs: {summary["pb_without_bombs"]}\n"
+        f"Separated security levels: {summary["split_security"]}\n"
+        f"Sector shuffle: {summary["sector_shuffle"]}\n"
+        f"Tube shuffle: {summary["tube_shuffle"]}\n"
+        f"Hide item graphics: {summary["hidden_items"]}")
+
+    palette_shuffle_header = "**Palette Shuffle**"
+    palette_shuffle_text = ""
+    palette_keys = ["tileset_shuffle", "sprite_shuffle", "suit_shuffle", "beam_shuffle"]
+    if not any(summary[key] for key in palette_keys):
+        palette_shuffle_text = "Disabled"
+    else:
+        palette_shuffle_text = (f"Tileset shuffle: {summary["tileset_shuffle"]}\n"
+                                f"Sprite shuffle: {summary["sprite_shuffle"]}\n"
+                                f"Suit shuffle: {summary["suit_shuffle"]}\n"
+                                f"Beam shuffle: {summary["beam_shuffle"]}")
+
+    logic_settings_text = logic_settings_text.strip()
+    palette_shuffle_text = palette_shuffle_text.strip()
+    embed.add_field(name=logic_settings_header, value=logic_settings_text)
+    embed.add_field(name=palette_shuffle_header, value=palette_shuffle_text)
+    return embed
+
+
+def spoiler_summary_embed(summary: dict) -> discord.Embed:
+    embed = discord.Embed()
+    embed.colour = discord.Colour.blue()
+    embed.title = "MFOR Spoiler File"
+    embed.description = f"Generated on {summary["version"]} with Seed `{summary["seed"]}`"
+    field_text = ""
+    field_header = f"**Logic Settings**"
+    for key, value in summary["settings"].items():
+        field_text += f"{key}: {value}\n"
+    field_text = field_text.strip()
+    embed.add_field(name=field_header, value=field_text)
+    return embed
+
+
+def create_bot(patch_workers: int = 2, patch_queue_size: int = 8, patch_timeout: float = 30,
+               cache_path: str | None = "analysis_cache.sqlite3", item_order_path: str = "item_orders.sqlite3",
+               strat_catalog_path: str = "strats.sqlite3", metrics_enabled: bool = False,
+               metrics_port: int | None = None, base_rom: BaseRom | None = None, sharded: bool = False,
+               lean: bool = False) -> tuple[commands.Bot, Callable[[], None]]:
+    """
+    Sets up the bot without connecting it, and returns it along with a coroutine function that releases everything it
+    holds once it's done running.
+    BPS patches are checked in a pool of patch_workers processes (0 to use a background thread instead), which holds
+    up to patch_queue_size waiting patches and gives up on a patch after patch_timeout seconds. They're applied to
+    base_rom, which is loaded from metroid4.gba if not given.
+    Analysis results are cached in memory and, unless cache_path is None, in an SQLite database at cache_path.
+    Item orders of spoiler logs are kept in an SQLite database at item_order_path, and strats added with the add
+    command in one at strat_catalog_path.
+    With metrics_enabled, latencies and counts are collected for the hidden stats command, and also served for
+    Prometheus on http://127.0.0.1:<metrics_port>/metrics if metrics_port is set.
+    Channels, emojis and reaction roles are set per server in guild_config.json. With sharded, the bot connects
+    through as many shards as Discord recommends for its number of servers.
+    With lean, member lists aren't downloaded at startup and neither members nor messages are cached, which keeps
+    memory use flat in large servers. Members are fetched when their roles need to be edited instead.
+    """
+    # Fail now rather than on the first patch if the base ROM is missing or wrong
+    if base_rom is None:
+        base_rom = BaseRom("metroid4.gba")
+    patch_pool = PatchPool(base_rom, patch_workers, patch_queue_size, patch_timeout)
+    analysis_cache = AnalysisCache(cache_path)
+    enemy_index = EnemyIndex("enemy_info.json")
+    x_drops = XDropSimulator(enemy_index)
+    guild_configs = GuildConfigIndex("guild_config.json")
+    role_updates = RoleUpdateQueue()
+    item_orders = ItemOrderStore(item_order_path)
+    strat_catalog = StratCatalog(strat_catalog_path)
+    # Splits files with long attempt histories can take up all of Discord's 10 MiB upload limit
+    attachment_fetcher = AttachmentFetcher({".json": 4 * 1024 * 1024, ".bps": 16 * 1024 * 1024,
+                                            ".lss": 10 * 1024 * 1024},
+                                           max_in_flight=64 * 1024 * 1024)
+
     intents = discord.Intents.default()
     intents.message_content = True
     intents.reactions = True
-    intents.members = True
+    # Only needed to download and cache every member, which the lean mode doesn't
+    intents.members = not lean
+    cache_options = {}
+    if lean:
+        cache_options = {"chunk_guilds_at_startup": False, "member_cache_flags": discord.MemberCacheFlags.none(),
+                         "max_messages": None}
+
+    metrics = Metrics(enabled=metrics_enabled or metrics_port is not None)
+    metrics.gauge("patch_pool_jobs", lambda: patch_pool.in_flight)
+    metrics.gauge("analysis_cache_hits", lambda: analysis_cache.hits + analysis_cache.disk_hits)
+    metrics.gauge("analysis_cache_misses", lambda: analysis_cache.misses)
+    metrics.gauge("role_update_queue_depth", lambda: role_updates.depth)
+    metrics.gauge("role_update_merge_ratio", lambda: role_updates.merge_ratio)
+    metrics.gauge("attachment_bytes_in_flight", lambda: attachment_fetcher.in_flight)
+    router = MessageRouter(metrics)
+    bot_class = commands.AutoShardedBot if sharded else commands.Bot
+    # Replies often repeat what people typed, which must not ping @everyone, roles or users
+    client = bot_class(command_prefix=commands.when_mentioned_or("!"), intents=intents,
+                       help_command=CustomHelpCommand(), allowed_mentions=discord.AllowedMentions.none(),
+                       **cache_options)
+
+    background_tasks = set()
+
+    @client.before_invoke
+    async def start_command_timer(ctx: Context):
+        ctx.started_at = time.perf_counter()
+
+    @client.after_invoke
+    async def stop_command_timer(ctx: Context):
+        metrics.observe("command_seconds", time.perf_counter() - ctx.started_at, command=ctx.command.qualified_name)
 
-    client = commands.Bot(command_prefix=commands.when_mentioned_or("!"), intents=intents,
-                          help_command=CustomHelpCommand())
+    @client.event
+    async def setup_hook():
+        # Handles the item order buttons of every spoiler log reply, including those sent before the last restart
+        ItemOrderButton.item_orders = item_orders
+        client.add_dynamic_items(ItemOrderButton)
+
+        if metrics.enabled:
+            metrics.count_rest_calls(client.http)
+            background_tasks.add(asyncio.create_task(metrics.watch_loop_lag()))
+        if metrics_port is not None:
+            await metrics.serve(metrics_port)
 
     @client.event
     async def on_ready():
@@ -45,323 +225,148 @@ def run_bot(discord_token: str):
 
     @client.event
     async def on_raw_reaction_add(payload: RawReactionActionEvent):
-        user = await client.fetch_user(payload.user_id)
-
-        if user.bot:
-            return
-
-        message = await client.get_channel(payload.channel_id).fetch_message(payload.message_id)
-
-        await act_with_role_on_react(payload.emoji, user, message, False)
+        with metrics.event("reaction"):
+            await act_with_role_on_react(payload, False)
 
     @client.event
     async def on_raw_reaction_remove(payload: RawReactionActionEvent):
-        user = await client.fetch_user(payload.user_id)
-
-        if user.bot:
-            return
-
-        message = await client.get_channel(payload.channel_id).fetch_message(payload.message_id)
-
-        await act_with_role_on_react(payload.emoji, user, message, True)
+        with metrics.event("reaction"):
+            await act_with_role_on_react(payload, True)
 
     @client.event
     async def on_message(message: Message):
         if message.author.bot:
             return
 
-        await react_to_mfor_spoiler_logs_if_exists(message)
-        await react_to_mfor_bps_file_if_exists(message)
-        await react_to_your_rat_pbs(message)
+        await router.dispatch(message)
 
+    @router.route()
+    async def process_commands(message: Message):
         await client.process_commands(message)
 
-    async def act_with_role_on_react(reaction: PartialEmoji, user: User, message: Message, remove: bool):
-        if message.channel.id != 1411451852003868913:  # roles channel
+    async def act_with_role_on_react(payload: RawReactionActionEvent, remove: bool):
+        # Everything needed to ignore unrelated reactions is in the payload, so they don't cost any requests
+        config = guild_configs.get(payload.guild_id)
+        if payload.channel_id != config.roles_channel_id:
             return
 
-        with open("role_reaction_mappings.json", "r") as f:
-            role_reaction_mappings = json.load(f)
-
-        message_id_str = str(message.id)
-        if message_id_str not in role_reaction_mappings:
+        role_id = config.role_for(payload.message_id, str(payload.emoji))
+        if role_id is None:
             return
 
-        role_str = role_reaction_mappings[message_id_str].get(str(reaction))
-        if not role_str:
+        guild = client.get_guild(payload.guild_id)
+        if guild is None:
             return
 
-        role = await message.guild.fetch_role(role_str)
-        member = await message.guild.fetch_member(user.id)
-
-        if remove:
-            await member.remove_roles(role)
-        else:
-            await member.add_roles(role)
+        # Only reaction adds come with the member, otherwise it should be in the member cache unless running lean
+        member = payload.member or guild.get_member(payload.user_id)
+        if member is None:
+            member = await guild.fetch_member(payload.user_id)
 
-    async def react_to_mfor_spoiler_logs_if_exists(message: Message):
-        if len(message.attachments) > 1:
+        if member.bot:
             return
 
-        for attachment in message.attachments:
-            if not attachment.filename.endswith(".json"):
+        role_updates.request(member, role_id, not remove)
+
+    async def analyze_spoiler_log(attachment: Attachment) -> tuple[discord.Embed | None, list | None, str | None]:
+        try:
+            spoiler_text = await attachment_fetcher.fetch(attachment)
+        except AttachmentTooLarge:
+            return None, None, f"`{attachment.filename}` is too large to be checked."
+
+        cache_key = analysis_cache.key("spoiler", spoiler_text)
+        summary = analysis_cache.get(cache_key)
+        if summary is None:
+            with metrics.timer("spoiler_analysis_seconds"):
+                summary = summarize_spoiler_log(spoiler_text)
+            analysis_cache.put(cache_key, summary)
+
+        return spoiler_summary_embed(summary), summary["item_order"], None
+
+    async def analyze_bps_file(attachment: Attachment) -> tuple[discord.Embed | None, list | None, str | None]:
+        try:
+            patch = await attachment_fetcher.fetch(attachment)
+        except AttachmentTooLarge:
+            return None, None, f"`{attachment.filename}` is too large to be checked."
+
+        cache_key = analysis_cache.key("bps", patch)
+        summary = analysis_cache.get(cache_key, MISSING)
+        if summary is MISSING:
+            try:
+                with metrics.timer("bps_analysis_seconds"):
+                    summary = await patch_pool.analyze(patch)
+            except PatchPoolBusy:
+                return None, None, (f"Too many patches are being checked right now, please try `{attachment.filename}` "
+                                    f"again in a bit.")
+            except TimeoutError:
+                return None, None, f"Checking `{attachment.filename}` took too long."
+            analysis_cache.put(cache_key, summary)
+
+        if summary is None:
+            # Not mfor
+            return None, None, None
+
+        return bps_summary_embed(attachment.filename, summary), None, None
+
+    @router.route(extensions=[".json", ".bps"])
+    async def react_to_mfor_files_if_exist(message: Message):
+        analyzers = {".json": analyze_spoiler_log, ".bps": analyze_bps_file}
+        attachments = [attachment for attachment in message.attachments
+                       if os.path.splitext(attachment.filename)[1].lower() in analyzers]
+
+        # One embed per file, and a message can't have more than that
+        results = await asyncio.gather(*(analyzers[os.path.splitext(attachment.filename)[1].lower()](attachment)
+                                         for attachment in attachments[:MAX_EMBEDS]), return_exceptions=True)
+
+        embeds = []
+        item_order_list = []
+        notes = []
+        for result in results:
+            if isinstance(result, Exception):
+                log.error("Could not analyze an attachment of message %s", message.id, exc_info=result)
                 continue
 
-            spoiler_text = await attachment.read()
-            spoiler = json.load(io.BytesIO(spoiler_text))
-
-            embed = discord.Embed()
-            embed.colour = discord.Colour.blue()
-            embed.title = "MFOR Spoiler File"
-            embed.description = f"Generated on {spoiler["MFOR Version"]} with Seed `{spoiler["Seed"]}`"
-            field_text = ""
-            field_header = f"**Logic Settings**"
-            for key, value in spoiler["Settings"].items():
-                if key in ["E-Tanks", "Missile Tanks", "Power Bomb Tanks"]:
-                    continue
-
-                field_text += f"{key}: {value}\n"
-            field_text = field_text.strip()
-            embed.add_field(name=field_header, value=field_text)
-
-            gen_button_spoilered = discord.ui.Button(label="Show Item Order (Spoilered)")
-            gen_button_revealed = discord.ui.Button(label="Show Item Order (Revealed)")
-
-            async def reply_with_gen_order(interaction: Interaction, spoilered: bool):
-                msg = "Item Order:\n"
-                spoiler_char = "||" if spoilered else ""
-                for index, (key, value) in enumerate(spoiler["Item order"].items()):
-                    msg += f"{index}. {spoiler_char}{value} at {key}{spoiler_char}\n"
-                msg = msg.strip()
-                await interaction.response.send_message(msg)
-
-            async def button_spoilered_callback(interaction: Interaction):
-                await reply_with_gen_order(interaction, True)
+            embed, item_order, note = result
+            if embed is not None:
+                embeds.append(embed)
+            if item_order is not None:
+                item_order_list.append(item_order)
+            if note is not None:
+                notes.append(note)
 
-            async def button_revealed_callback(interaction: Interaction):
-                await reply_with_gen_order(interaction, False)
-
-            gen_button_spoilered.callback = button_spoilered_callback
-            gen_button_revealed.callback = button_revealed_callback
-
-            view = discord.ui.View()
-            view.add_item(gen_button_spoilered)
-            view.add_item(gen_button_revealed)
-
-            await message.reply(embed=embed, view=view, mention_author=False)
-
-    async def react_to_mfor_bps_file_if_exists(message: Message):
-        if len(message.attachments) > 1:
+        if not embeds and not notes:
             return
 
-        for attachment in message.attachments:
-            if not attachment.filename.endswith(".bps"):
-                continue
-
-            rom = Rom("metroid4.gba")
-
-            with open("metroid4.gba", "rb") as f:
-                rom.data = BpsDecoder().apply_patch(await attachment.read(), f.read())
-
-                if rom.read_ascii(7657860, 9) != "RED DOORS":
-                    # Not mfor
-                    return
-
-            # Prepare offsets and data
-            hidden_data_offset = 3926048
-            security_offset = 479192
-            pb_offsets = (24756, 24756)
-            sax_offset = 395796
-            box_offset = 8326096
-            varia_core_offset = 8326260
-            missile_data_offsets = (24828, sax_offset + 1, 465582, box_offset + 13, box_offset + 21, box_offset + 29,
-                                    varia_core_offset + 13, varia_core_offset + 21, varia_core_offset + 29)
-
-            source_area = 0
-            start_address = mars_game_data.area_connections(rom)
-            area_connections = {}
-            while source_area != 255:
-                source_area = rom.read_8(start_address)
-                source_door = rom.read_8(start_address + 1)
-                target_area = rom.read_8(start_address + 2)
-                start_address += 3
-                area_connections[f"{source_area}-{source_door}"] = target_area
-
-            major_locations = [
-                # Bosses
-                "Arachnus",
-                "Yakuza",
-                "Ridley",
-                "Charge Core-X",
-                "Zazabi",
-                "Nettori",
-                "Wide Core-X",
-                "Serris",
-                "Nightmare",
-                "Mega Core-X",
-                "BOX-2",
-                # Data
-                "Main Deck : Data Room",
-                'Sector 2 : Data Room',
-                'Sector 3 : Data Room',
-                'Sector 4 : Data Room',
-                'Sector 5 : Data Room',
-                # E-tank
-                "Arachnus Room",
-                "Reactor Silo Hallway",
-                "Arachnus Alcove",
-                "Sector 1: Entry Hallway",
-                "Ridley Area E-Tank",
-                'Sector 1: Speed Ceiling',
-                "Sector 2: Zazabi Access",
-                "Sector 2: Nettori Owtches",
-                "Crumble City Upper Item",
-                "Sector 3: Sidehopper Hallway",
-                "Sector 3: Upper Nova Stairway",
-                "Sector 3: Shinespark Puzzle",
-                "Sector 4: Collapsed Ceiling",
-                "Sector 4: Crab Battle",
-                "Sector 5: E-Tank Mimic",
-                "Sector 5: Minifridge",
-                "Sector 5: Nightmare Drop",
-                "Sector 6: Power Bomb Wall",
-                "Sector 6: Bomb Chain Alcove",
-                "Sector 6: Pillar Highway",
-                # Security room
-                "Sector 2 : Security Room",
-                "Sector 3 : Security Room",
-                "Sector 5 : Security Room",
-                "Sector 4 : Security Room",
-            ]
-            major_offsets = {
-                'ChargeBeam': 7655617,
-                'WideBeam': 7655725,
-                'PlasmaBeam': 7655833,
-                'WaveBeam': 7655941,
-                'IceBeam': 7656049,
-                'MainMissiles': 7656157,
-                'SuperMissileItem': 7656265,
-                'IceMissileItem': 7656373,
-                'DiffusionItem': 7656481,
-                'Bombs': 7656589,
-                'MainPowerBombs': 7656697,
-                'MorphBall': 7656805,
-                'HiJumpBoots': 7656913,
-                'SpeedBooster': 7657021,
-                'SpaceJump': 7657129,
-                'ScrewAttack': 7657237,
-                'VariaSuit': 7657345,
-                'GravitySuit': 7657453,
-                'GreenDoors': 7657561,
-                'BlueDoors': 7657669,
-                'YellowDoors': 7657777,
-                'RedDoors': 7657885,
-            }
-
-            hidden_items = rom.read_bytes(hidden_data_offset, 24) == b"L\x00M\x00N\x00O\x00" * 3
-
-            is_major_minor_split = True
-            for major, offset in major_offsets.items():
-                last_read = b"\xFF"
-                chars = 0
-                while last_read != 0:
-                    last_read = rom.read_8(offset + chars)
-                    chars += 1
-                location = rom.read_ascii(offset, chars - 1).strip()
-                if location not in major_locations:
-                    is_major_minor_split = False
-                    break
-
-            missile_upgrades_give_data = "".join(
-                [str(rom.read_8(offset)) for offset in missile_data_offsets]) == "151515248248"
-            pb_without_bombs = rom.read_8(pb_offsets[0]) == rom.read_8(pb_offsets[1]) == 32
-            split_security = rom.read_16(security_offset) == 0
-
-            vanilla_elevators = True
-            for index, room in enumerate(MAIN_HUB_ELE_DOORS, start=1):
-                if area_connections[f"0-{room}"] != index:
-                    vanilla_elevators = False
-                    break
-
-            vanilla_left_tubes = [3, 1, 5, 2, 6, 4]
-            vanilla_right_tubes = [2, 4, 1, 6, 3, 5]
-            rom_left_tubes = [area_connections[f"{index}-{door}"] for index, door in
-                              enumerate(SHORTCUT_LEFT_DOORS, start=1)]
-            rom_right_tubes = [area_connections[f"{index}-{door}"] for index, door in
-                               enumerate(SHORTCUT_RIGHT_DOORS, start=1)]
-            vanilla_tubes = vanilla_left_tubes == rom_left_tubes and vanilla_right_tubes == rom_right_tubes
-
-            first_tileset_offset = 4219100
-            first_tileset_length = 8
-            first_tileset_data = b'\xe0B@\xff\xb3^%\xa1\xc2\x0b-\xc3\xe0\x03=\x08'
-            vanilla_tilesets = b"".join([rom.read_bytes(first_tileset_offset + index * 15, 2) for index in
-                                         range(first_tileset_length)]) == first_tileset_data
-
-            first_sprite_offset = 2835304
-            first_sprite_length = 8
-            first_sprite_data = b'\xc0B\x02\xff\x84\x13+\xed\xeec\x03\xf4\xf2K"\xfb'
-            vanilla_sprites = b"".join([rom.read_bytes(first_sprite_offset + index * 15, 2) for index in
-                                        range(first_sprite_length)]) == first_sprite_data
-
-            first_suit_offset = 2678268
-            first_suit_length = 8
-            first_suit_data = b'\x84|S_\xf1G\x7f\x00\xe81S\xef\x00\x00%\x1f'
-            vanilla_suits = b"".join([rom.read_bytes(first_suit_offset + index * 15, 2) for index in
-                                      range(first_suit_length)]) == first_suit_data
-
-            first_beams_offset = 5813348
-            first_beams_length = 9
-            first_beams_data = b'\x00\x00\x00\xff\xff\x7f\x7f\xff\xff\x1f\x1f\xfd\xfd\x02\x02??%'
-            vanilla_beams = b"".join([rom.read_bytes(first_beams_offset + index, 2) for index in
-                                      range(first_beams_length)]) == first_beams_data
-
-            embed = discord.Embed()
-            embed.colour = discord.Colour.blue()
-            embed.title = "MFOR BPS Patch File"
-            filename = attachment.filename.replace("_", " ")
-            embed.description = f"File `{filename}`"
-            logic_settings_header = f"**Logic Settings**"
-            logic_settings_text = (
-                f"Item pool: {"Major items anywhere" if not is_major_minor_split else "Limited major item locations"}\n"
-                f"Missile upgrades enable Missiles: {missile_upgrades_give_data}\n"
-                f"Power Bombs without normal Bombs: {pb_without_bombs}\n"
-                f"Separated security levels: {split_security}\n"
-                f"Sector shuffle: {not vanilla_elevators}\n"
-                f"Tube shuffle: {not vanilla_tubes}\n"
-                f"Hide item graphics: {hidden_items}")
-
-            palette_shuffle_header = "**Palette Shuffle**"
-            palette_shuffle_text = ""
-            if vanilla_tilesets and vanilla_beams and vanilla_suits and vanilla_sprites:
-                palette_shuffle_text = "Disabled"
-            else:
-                palette_shuffle_text = (f"Tileset shuffle: {not vanilla_tilesets}\n"
-                                        f"Sprite shuffle: {not vanilla_sprites}\n"
-                                        f"Suit shuffle: {not vanilla_suits}\n"
-                                        f"Beam shuffle: {not vanilla_beams}")
-
-            logic_settings_text = logic_settings_text.strip()
-            palette_shuffle_text = palette_shuffle_text.strip()
-            embed.add_field(name=logic_settings_header, value=logic_settings_text)
-            embed.add_field(name=palette_shuffle_header, value=palette_shuffle_text)
-            await message.reply(embed=embed, mention_author=False)
-
+        view = None
+        if item_order_list:
+            # Only sent for its buttons, clicks are handled by ItemOrderButton. Stopping it keeps discord.py from
+            # holding on to it for every reply.
+            view = discord.ui.View(timeout=None)
+            for position in range(len(item_order_list)):
+                view.add_item(ItemOrderButton.for_spoiler_log(True, position, len(item_order_list)))
+                view.add_item(ItemOrderButton.for_spoiler_log(False, position, len(item_order_list)))
+            view.stop()
+
+        reply = await message.reply("\n".join(notes) or None, embeds=embeds, view=view, mention_author=False)
+        for position, item_order in enumerate(item_order_list):
+            item_orders.put(reply.id, position, item_order)
+
+    def is_your_rat_pb(message: Message) -> bool:
+        return (message.content == "YOUR RAT" and len(message.attachments) > 0 and message.guild is not None
+                and guild_configs.is_channel(message.channel, guild_configs.get(message.guild.id).pb_brag_channel))
+
+    @router.route(predicate=is_your_rat_pb)
     async def react_to_your_rat_pbs(message: Message):
-        if message.channel.name != "pb-brag":
-            return
-
-        if message.content != "YOUR RAT" or len(message.attachments) == 0:
-            return
-
-        await message.add_reaction(message.guild.get_emoji(1407560417932214352))  # Your Rat
+        emoji = message.guild.get_emoji(guild_configs.get(message.guild.id).your_rat_emoji_id)
+        if emoji is not None:
+            await message.add_reaction(emoji)
         await message.channel.send("YOUR RAT")
 
     @client.command()
     async def add(ctx: Context, *, message: str):
         """
-        <link>, <strat name>, <location>, <category>, <author(s)> to add a strat in <#1172342441349754980>
+        <link>, <strat name>, <location>, <category>, <author(s)> to add a strat to this server's strats channel
         """
-        # (^ #strats)
         parsed = [s.strip() for s in message.split(",")]
         # If the parsed array is not 4 or 5 arguments, print the desired format
         if len(parsed) < 4 or len(parsed) > 5 or "" in parsed:
@@ -369,15 +374,67 @@ def run_bot(discord_token: str):
                            "(if you want to include an author besides yourself)")
             return
 
+        strat_channel = guild_configs.channel(ctx.guild, guild_configs.get(ctx.guild.id).strats_channel)
+        if strat_channel is None:
+            await ctx.send("This server doesn't have a strats channel set up.")
+            return
+
         thumbs_up = '👍'
         await ctx.message.add_reaction(thumbs_up)
 
-        strat_channel = discord.utils.get(ctx.guild.channels, name='strats')
-
         link, name, region, category = parsed[0], parsed[1], parsed[2], parsed[3]
         author = parsed[4] if len(parsed) >= 5 else ctx.author.name
 
-        await strat_channel.send(f"[{name}]({link}), in {region} for {category} by {author}")
+        strat = Strat(link, name, region, category, author)
+        post = await strat_channel.send(strat.post())
+        strat_catalog.add(ctx.guild.id, post.id, strat)
+
+    @client.command()
+    @commands.guild_only()
+    async def strat(ctx: Context, *, search: str):
+        """
+        <words> location: <location> category: <category> to search the strats, location and category are optional
+        """
+        query, location, category = parse_strat_search(search)
+        strats = strat_catalog.search(ctx.guild.id, query, location, category)
+        if not strats:
+            await ctx.send("Couldn't find any strats for that.")
+            return
+
+        # The links would all be embedded otherwise
+        await ctx.send("\n".join(f"[{strat.name}](<{strat.link}>), in {strat.location} for {strat.category} by "
+                                 f"{strat.author}" for strat in strats)[:2000])
+
+    @client.command(hidden=True, ignore_extra=False)
+    @commands.has_guild_permissions(administrator=True)
+    async def backfill_strats(ctx: Context):
+        # Adds the strats posted before there was a catalog, picking up where it stopped if it was interrupted
+        strat_channel = guild_configs.channel(ctx.guild, guild_configs.get(ctx.guild.id).strats_channel)
+        if strat_channel is None:
+            await ctx.send("This server doesn't have a strats channel set up.")
+            return
+
+        last_message_id, done = strat_catalog.backfill_progress(ctx.guild.id)
+        if done:
+            await ctx.send("The strats channel was already read into the catalog.")
+            return
+
+        await ctx.message.add_reaction('👍')
+        added = 0
+        batch = []
+        after = discord.Object(id=last_message_id) if last_message_id is not None else None
+        # discord.py requests the history 100 messages at a time, they're written to the catalog in larger batches
+        async for post in strat_channel.history(limit=None, after=after, oldest_first=True):
+            strat = Strat.from_post(post.content)
+            if strat is not None:
+                batch.append((post.id, strat))
+            last_message_id = post.id
+            if len(batch) == STRAT_BACKFILL_BATCH:
+                added += strat_catalog.add_backfilled(ctx.guild.id, batch, last_message_id, False)
+                batch = []
+        added += strat_catalog.add_backfilled(ctx.guild.id, batch, last_message_id, True)
+
+        await ctx.send(f"Added {added} strats from {strat_channel.mention} to the catalog.")
 
     @client.command(ignore_extra=False)
     async def bizhawk(ctx: Context):
@@ -411,92 +468,74 @@ def run_bot(discord_token: str):
                        "[Japanese Debug Patch](<https://www.speedrun.com/fusion/resources/894i6>)\n"
                        "[Japanese Skip Loading Fanfare Patch](<https://www.speedrun.com/fusion/resources/mbqvq>)\n")
 
-    @client.command(ignore_extra=False)
-    async def nso(ctx: Context, timestamp_as_str: str):
+    @client.command()
+    async def nso(ctx: Context, *, times: str = ""):
         """
-        for converting NSO runs. Usage is <hour>:<minutes>:<seconds>.<milliseconds> (milliseconds optional)
+        for converting NSO runs. Usage is <hour>:<minutes>:<seconds>.<milliseconds> (milliseconds optional), also takes a list of splits or an attached .lss file
         """
+        usage = ("Usage: nso <hour>:<minutes>:<seconds>.<milliseconds> (milliseconds optional), a list of splits "
+                 "with one time per line, or an attached LiveSplit .lss file")
+
+        splits_files = [attachment for attachment in ctx.message.attachments
+                        if os.path.splitext(attachment.filename)[1].lower() == ".lss"]
+        if splits_files:
+            attachment = splits_files[0]
+            try:
+                data = await attachment_fetcher.fetch(attachment)
+            except AttachmentTooLarge:
+                await ctx.send(f"`{attachment.filename}` is too large to be converted.")
+                return
+            try:
+                # Files near the size limit have over a hundred thousand times, which take about half a second
+                converted = await asyncio.to_thread(convert_lss, bytes(data))
+            except ValueError as e:
+                await ctx.send(f"Couldn't convert `{attachment.filename}`. {e}")
+                return
+
+            filename = f"{os.path.splitext(attachment.filename)[0]} (original hardware).lss"
+            await ctx.send("Here are your splits, converted to original hardware.",
+                           file=discord.File(io.BytesIO(converted), filename))
+            return
 
-        if "." not in timestamp_as_str:
-            timestamp_as_str += ".0"
-
-        date = datetime.strptime(timestamp_as_str, "%H:%M:%S.%f").time()
-        original_delta = timedelta(hours=date.hour, minutes=date.minute, seconds=date.second,
-                                   microseconds=date.microsecond)
-        multiplier = (60 / 59.7275)
-        new_delta = original_delta * multiplier
-
-        def timedelta_to_string(delta: timedelta) -> str:
-            days, seconds = delta.days, delta.seconds
-            hours = days * 24 + seconds // 3600
-            minutes = (seconds % 3600) // 60
-            seconds = seconds % 60
-
-            # This is convoluted, surely there's a better way?
-            # We want to round microseconds. But since those are ints (e.g. 96738), we string-convert them to a float,
-            # round them there, string convert them again to get the part past decimal, and then finally convert
-            # that as int.
-            microseconds = int(str(round(float(f"0.{delta.microseconds}"), 2)).split(".")[1])
-
-            return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{microseconds:<02d}"
+        if not contains_time(times):
+            await ctx.send(usage)
+            return
 
-        old_time = timedelta_to_string(original_delta)
-        new_time = timedelta_to_string(new_delta)
+        try:
+            ticks, digits = parse_time(times)
+        except ValueError:
+            # More than one time, like a list of splits
+            converted = await asyncio.to_thread(convert_times_in_text, times)
+            if len(converted) + len("```\n\n```") <= 2000:
+                await ctx.send(f"```\n{converted}\n```")
+            else:
+                await ctx.send(file=discord.File(io.BytesIO(converted.encode("utf-8")),
+                                                 "splits (original hardware).txt"))
+            return
 
+        old_time = format_time(ticks, digits)
+        new_time = format_time(to_original_hardware(ticks), digits)
         await ctx.send(f"A {old_time} on Nintendo Switch is equivalent to a {new_time} on original hardware")
 
-    def find_enemy(enemy_name: str) -> tuple[str, dict]:
-        with open("enemy_info.json", "r") as f:
-            enemy_info = json.load(f)
-
-        for enemy, info in enemy_info.items():
-            valid_names = [enemy] + info.get("aliases", [])
-
-            if enemy_name in valid_names:
-                return enemy, info
-
-        return "", {}
-
-    def get_all_enemies() -> dict[str, dict]:
-        with open("enemy_info.json", "r") as f:
-            return json.load(f)
-
-    def find_related_enemies(base_enemy: str) -> list[tuple[str, dict]]:
-        parent_name, parent_info = find_enemy(base_enemy)
-
-        if not parent_name:
-            return []
-
-        enemies = []
-        has_children = "children" in parent_info
-        if not has_children:
-            # If it doesn't have children defined, check if it has a parent
-            for enemy_name, enemy_info in get_all_enemies().items():
-                if parent_name not in enemy_info.get("children", []):
-                    continue
-
-                parent_name = enemy_name
-                parent_info = enemy_info
-                break
-
-        enemies.append((parent_name, parent_info))
-        for child in parent_info.get("children", []):
-            child_name, child_info = find_enemy(child)
-            if not child_name:
-                raise ValueError(f"Error: Cannot find data for {child}!!!")
-
-            enemies.append((child_name, child_info))
-
-        return enemies
+    async def send_enemy_not_found(ctx: Context, enemy_name: str):
+        suggestions = enemy_index.search(enemy_name, 3) if enemy_name else []
+        if suggestions:
+            await ctx.send(f"Couldn't find {enemy_name}. Did you mean {" or ".join(suggestions)}?")
+        else:
+            await ctx.send(f"Couldn't find {enemy_name}.")
 
-    @client.command()
+    @client.hybrid_command(description="for the health of an enemy")
+    @app_commands.describe(message="Name of the enemy")
     async def hp(ctx: Context, *, message=""):
         """
         for the health of an enemy [(list of enemy names)](<https://docs.google.com/spreadsheets/d/1S7UH4Mo8BPfYlp39hxPVUth-IQzjBVaxVK0oC8qWOvA/edit?usp=sharing>)
         """
         enemy_name = message.lower()
 
-        enemies = find_related_enemies(enemy_name)
+        enemies = enemy_index.find_related(enemy_name)
+        if not enemies:
+            await send_enemy_not_found(ctx, enemy_name)
+            return
 
         message = ""
         for enemy_name, enemy_info in enemies:
@@ -505,6 +544,80 @@ def run_bot(discord_token: str):
 
         await ctx.send(message)
 
+    @hp.autocomplete("message")
+    async def hp_autocomplete(interaction: Interaction, current: str) -> list[app_commands.Choice[str]]:
+        # Discord shows at most 25 choices
+        return [app_commands.Choice(name=name, value=name) for name in enemy_index.search(current.lower(), 25)]
+
+    @client.command()
+    async def xdrop(ctx: Context, *, route: str = ""):
+        """
+        for the chances of X drops restoring enough. Usage is <enemy> x<kills>, <enemy> x<kills> energy: <amount> missiles: <amount>
+        """
+        kills, energy_target, missiles_target = parse_route(route)
+        if not kills:
+            await ctx.send("Usage: xdrop <enemy> x<kills>, <enemy> x<kills> energy: <amount> missiles: <amount> "
+                           "(targets optional)")
+            return
+
+        named_kills = []
+        for enemy_name, count in kills:
+            enemy, _ = enemy_index.find(enemy_name)
+            if not enemy:
+                await send_enemy_not_found(ctx, enemy_name)
+                return
+            named_kills.append((enemy, count))
+
+        try:
+            # Sampling a million runs takes up to a few hundred milliseconds for long routes
+            result = await asyncio.to_thread(x_drops.simulate, named_kills)
+        except ValueError as e:
+            await ctx.send(f"{e}.")
+            return
+
+        route_text = ", ".join(f"{count} {enemy.title()}" for enemy, count in named_kills)
+        message = f"X drops from killing {route_text}, over {result.trials:,} runs:\n"
+        for name, amounts in (("Energy", result.energy), ("Missiles", result.missiles)):
+            mean, low, median, high, best = describe_amounts(amounts)
+            message += f"{name}: {mean:.1f} on average, {low} to {high} in 90% of runs (median {median}, best {best})\n"
+        if energy_target or missiles_target:
+            targets = " and ".join(f"{amount} {name}" for name, amount in (("energy", energy_target),
+                                                                            ("missiles", missiles_target)) if amount)
+            message += f"Chance of getting at least {targets}: {result.chance_of(energy_target, missiles_target):.2%}"
+        await ctx.send(message)
+
+    @client.command(hidden=True, ignore_extra=False)
+    @commands.is_owner()
+    async def sync(ctx: Context):
+        # Registers the slash versions of hybrid commands. Global syncs are rate limited, so this is only done when
+        # commands changed rather than on every start.
+        synced = await client.tree.sync()
+        await ctx.send(f"Synced {len(synced)} slash commands.")
+
+    @client.command(hidden=True, ignore_extra=False)
+    @commands.has_guild_permissions(administrator=True)
+    async def stats(ctx: Context):
+        if not metrics.enabled:
+            await ctx.send("Metrics are turned off.")
+            return
+
+        message = "```\n"
+        for (name, labels), histogram in sorted(metrics.histograms().items()):
+            label_text = ",".join(value for _, value in labels)
+            line = (f"{name}{f"[{label_text}]" if label_text else ""}: n={histogram.count} "
+                    f"avg={histogram.sum / histogram.count:.4g} p50<={histogram.quantile(0.5)} "
+                    f"p99<={histogram.quantile(0.99)}\n")
+            if len(message) + len(line) > 1990:
+                break
+            message += line
+        for name, value in sorted(metrics.gauges().items()):
+            line = f"{name}: {value:.4g}\n"
+            if len(message) + len(line) > 1990:
+                break
+            message += line
+        message += "```"
+        await ctx.send(message)
+
     @client.command(ignore_extra=False)
     async def damage(ctx: Context):
         """
@@ -516,6 +629,34 @@ def run_bot(discord_token: str):
     @client.command(hidden=True, name=f"y{"o" * 11}", ignore_extra=False)
     async def long_yooo_response(ctx: Context):
         # responds to an 11 o yooooooooooo
-        await ctx.send(f"{ctx.message.author.mention} y{"o" * 11}")
-
-    client.run(discord_token)
+        await ctx.send(f"{ctx.message.author.mention} y{"o" * 11}",
+                       allowed_mentions=discord.AllowedMentions(users=[ctx.message.author]))
+
+    async def close_resources():
+        await attachment_fetcher.close()
+        patch_pool.shutdown()
+        analysis_cache.close()
+        item_orders.close()
+        strat_catalog.close()
+
+    return client, close_resources
+
+
+def run_bot(discord_token: str, **options):
+    """Runs the bot until it's stopped. Takes the same options as create_bot."""
+    client, close_resources = create_bot(**options)
+
+    async def run():
+        try:
+            async with client:
+                await client.start(discord_token)
+        finally:
+            # Some of the resources can only be closed inside the event loop
+            await close_resources()
+
+    # What client.run would do, other than closing the resources
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,150 @@
+import json
+import math
+import os
+from bisect import bisect_left
+from collections import Counter
+
+from watched_file import WatchedFile
+
+# How similar a name has to be to the search to be suggested, as the Dice coefficient of their trigrams
+MIN_SIMILARITY = 0.3
+
+
+def _trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+class NameSearch:
+    """Finds names that start with or resemble a search term, for suggestions and autocompletion."""
+
+    def __init__(self, names: dict[str, str]):
+        # Every name or alias, mapped to what it's a name of
+        self.names = names
+        self._sorted = sorted(names)
+        self._trigram_counts = {}
+        self._postings: dict[str, list[str]] = {}
+        for name in names:
+            trigrams = _trigrams(name)
+            self._trigram_counts[name] = len(trigrams)
+            for trigram in trigrams:
+                self._postings.setdefault(trigram, []).append(name)
+
+    def _starting_with(self, prefix: str, limit: int) -> list[str]:
+        index = bisect_left(self._sorted, prefix)
+        matches = []
+        while index < len(self._sorted) and len(matches) < limit and self._sorted[index].startswith(prefix):
+            matches.append(self._sorted[index])
+            index += 1
+        return matches
+
+    def search(self, query: str, limit: int = 5) -> list[str]:
+        """
+        Returns up to limit names or aliases matching the query, best first. Names starting with the query come
+        first, then names sharing enough trigrams with it. Only the best name for every target is returned.
+        """
+        results = []
+        seen = set()
+
+        def add(names: list[str]) -> bool:
+            for name in names:
+                if self.names[name] not in seen:
+                    seen.add(self.names[name])
+                    results.append(name)
+                    if len(results) == limit:
+                        return True
+            return False
+
+        if add(self._starting_with(query, limit)):
+            return results
+
+        # A name needs to share at least this many trigrams with the query to be similar enough, which rules out most
+        # names before their similarity has to be worked out
+        query_trigrams = _trigrams(query)
+        needed = max(math.ceil(MIN_SIMILARITY * len(query_trigrams) / (2 - MIN_SIMILARITY)), 1)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._postings.get(trigram, ()))
+
+        scored = []
+        for name, count in shared.items():
+            if count < needed:
+                continue
+            similarity = 2 * count / (len(query_trigrams) + self._trigram_counts[name])
+            if similarity >= MIN_SIMILARITY:
+                scored.append((-similarity, name))
+        add([name for _, name in sorted(scored)])
+        return results
+
+
+class EnemyIndex(WatchedFile):
+    """
+    Enemy info from enemy_info.json, indexed by every name and alias. The file is read again whenever it changes on
+    disk, so it can be edited while the bot runs.
+    """
+
+    description = "enemy info"
+
+    def __init__(self, path: str | os.PathLike[str]):
+        super().__init__(path)
+        # enemies, canonical names by name or alias, families by canonical name and the name search, swapped together
+        # on reload
+        self._snapshot: tuple[dict[str, dict], dict[str, str], dict[str, list[tuple[str, dict]]], NameSearch] = \
+            ({}, {}, {}, NameSearch({}))
+        self.reload()
+
+    def load(self):
+        """Reads and indexes the file. Raises a ValueError if a child enemy doesn't have any data."""
+        with open(self.path, "r") as f:
+            enemies = json.load(f)
+
+        # Earlier enemies win if a name is used twice
+        names = {}
+        parents = {}
+        for enemy, info in enemies.items():
+            for name in [enemy] + info.get("aliases", []):
+                names.setdefault(name, enemy)
+            for child in info.get("children", []):
+                parents.setdefault(child, enemy)
+
+        families = {}
+        for enemy, info in enemies.items():
+            parent = enemy if "children" in info else parents.get(enemy, enemy)
+            family = [(parent, enemies[parent])]
+            for child in enemies[parent].get("children", []):
+                if child not in names:
+                    raise ValueError(f"Error: Cannot find data for {child}!!!")
+                family.append((names[child], enemies[names[child]]))
+            families[enemy] = family
+
+        self._snapshot = (enemies, names, families, NameSearch(names))
+
+    def all(self) -> dict[str, dict]:
+        self._reload_if_changed()
+        return self._snapshot[0]
+
+    def find(self, enemy_name: str) -> tuple[str, dict]:
+        """Returns the name and info of the enemy with the given name or alias, or ("", {}) if there is none."""
+        self._reload_if_changed()
+        enemies, names, _, _ = self._snapshot
+        enemy = names.get(enemy_name)
+        if enemy is None:
+            return "", {}
+        return enemy, enemies[enemy]
+
+    def find_related(self, enemy_name: str) -> list[tuple[str, dict]]:
+        """
+        Returns the enemy with the given name or alias along with its family: its parent first if it has one, then
+        all of the parent's children. Returns an empty list if there is no such enemy.
+        """
+        self._reload_if_changed()
+        _, names, families, _ = self._snapshot
+        enemy = names.get(enemy_name)
+        if enemy is None:
+            return []
+        return families[enemy]
+
+    def search(self, query: str, limit: int = 5) -> list[str]:
+        """Returns up to limit enemy names or aliases that start with or look like the query, best first."""
+        self._reload_if_changed()
+        return self._snapshot[3].search(query, limit)
@@ -0,0 +1,112 @@
+import json
+import os
+from dataclasses import dataclass, field, fields
+
+import discord
+
+from watched_file import WatchedFile
+
+# The settings that hold a channel id or name
+_CHANNEL_SETTINGS = ("strats_channel", "pb_brag_channel")
+
+
+@dataclass(frozen=True)
+class GuildConfig:
+    """
+    Where the bot does what in a server. Channels are given by id, or by name for servers whose channel ids aren't
+    known yet. Names made of only digits are taken as ids.
+    """
+    roles_channel_id: int | None = None
+    strats_channel: int | str | None = None
+    pb_brag_channel: int | str | None = None
+    your_rat_emoji_id: int | None = None
+    # Role ids by emoji by message id, for the reaction roles in the roles channel
+    role_reactions: dict[int, dict[str, int]] = field(default_factory=dict)
+
+    def role_for(self, message_id: int, emoji: str) -> int | None:
+        """Returns the id of the role given for reacting to the message with the emoji, if there is one."""
+        roles = self.role_reactions.get(message_id)
+        if roles is None:
+            return None
+        return roles.get(emoji)
+
+
+def _parse_config(entry: dict, defaults: GuildConfig) -> GuildConfig:
+    names = {f.name for f in fields(GuildConfig)}
+    unknown = set(entry) - names
+    if unknown:
+        raise ValueError(f"Unknown settings {", ".join(sorted(unknown))}")
+
+    values = {f.name: getattr(defaults, f.name) for f in fields(GuildConfig)}
+    values.update(entry)
+    for name in _CHANNEL_SETTINGS:
+        # Ids are easily written as strings, since they're too long to be read back exactly by some JSON tools
+        if isinstance(values[name], str) and values[name].isdigit():
+            values[name] = int(values[name])
+    values["role_reactions"] = {int(message_id): {emoji: int(role_id) for emoji, role_id in roles.items()}
+                                for message_id, roles in values["role_reactions"].items()}
+    return GuildConfig(**values)
+
+
+class GuildConfigIndex(WatchedFile):
+    """
+    The configuration of every server, from guild_config.json, indexed by guild id. The "default" entry applies to
+    servers that aren't listed, and fills in whatever a listed server leaves out. The file is read again whenever it
+    changes on disk.
+    """
+
+    description = "guild configuration"
+
+    def __init__(self, path: str | os.PathLike[str]):
+        super().__init__(path)
+        self._default = GuildConfig()
+        self._configs: dict[int, GuildConfig] = {}
+        # Channel ids by (guild id, name), for channels configured by name
+        self._channel_ids: dict[tuple[int, str], int] = {}
+        self.reload()
+
+    def load(self):
+        """Reads the file. Raises a ValueError if it has settings that don't exist."""
+        with open(self.path, "r") as f:
+            entries = json.load(f)
+
+        default = _parse_config(entries.get("default", {}), GuildConfig())
+        configs = {int(guild_id): _parse_config(entry, default)
+                   for guild_id, entry in entries.items() if guild_id != "default"}
+
+        self._default = default
+        self._configs = configs
+        self._channel_ids = {}
+
+    def get(self, guild_id: int | None) -> GuildConfig:
+        self._reload_if_changed()
+        return self._configs.get(guild_id, self._default)
+
+    def channel(self, guild: discord.Guild, channel: int | str | None) -> discord.abc.GuildChannel | None:
+        """
+        Returns the configured channel if it's in the guild. Channels configured by name are only searched for by
+        name again if the one found before was deleted or renamed.
+        """
+        if isinstance(channel, str):
+            key = (guild.id, channel)
+            channel_id = self._channel_ids.get(key)
+            if channel_id is not None:
+                found = guild.get_channel(channel_id)
+                if found is not None and found.name == channel:
+                    return found
+                del self._channel_ids[key]
+
+            found = discord.utils.get(guild.channels, name=channel)
+            if found is not None:
+                self._channel_ids[key] = found.id
+            return found
+
+        if channel is None:
+            return None
+        return guild.get_channel(channel)
+
+    def is_channel(self, channel: discord.abc.Messageable, configured: int | str | None) -> bool:
+        """Returns whether the channel is the configured one, without looking anything up."""
+        if isinstance(configured, str):
+            return getattr(channel, "name", None) == configured
+        return configured is not None and getattr(channel, "id", None) == configured
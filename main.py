@@ -1,7 +1,22 @@
+import argparse
+
 import cstrattyw
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Runs the bot with the token in token.txt.")
+    parser.add_argument("--metrics", action="store_true", help="collect latencies and counts for the !stats command")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="also serve the metrics for Prometheus on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--lean", action="store_true",
+                        help="don't download member lists or cache members and messages, for large servers")
+    parser.add_argument("--sharded", action="store_true",
+                        help="connect through as many shards as Discord recommends")
+    parser.add_argument("--patch-workers", type=int, default=2,
+                        help="processes checking BPS patches, 0 to check them in a background thread")
+    args = parser.parse_args()
+
     with open("token.txt", "r") as f:
         token = f.readlines()[0].strip()
 
-    cstrattyw.run_bot(token)
+    cstrattyw.run_bot(token, metrics_enabled=args.metrics, metrics_port=args.metrics_port, lean=args.lean,
+                      sharded=args.sharded, patch_workers=args.patch_workers)
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Iterator
+
+from aiohttp import web
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds of the buckets for counts, like REST calls per event
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+# REST calls made so far by the event being handled, if any
+_rest_calls: ContextVar[list[int] | None] = ContextVar("rest_calls", default=None)
+
+_null_context = contextlib.nullcontext()
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        # One count per bucket, plus one for everything above the last
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Returns the upper bound of the bucket that holds the q-quantile, or inf if it's above every bucket."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Collects latency histograms, counters and gauges, and serves them in the Prometheus text format.
+    When disabled, recording does nothing and timers are a shared no-op context manager.
+    """
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._histograms: dict[tuple[str, Labels], Histogram] = {}
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = BUCKETS, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def gauge(self, name: str, callback: Callable[[], float]):
+        """Registers a gauge whose value is read from the callback whenever metrics are collected."""
+        self._gauges[name] = callback
+
+    @contextlib.contextmanager
+    def _timer(self, name: str, labels: dict[str, str]) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timer(self, name: str, **labels: str) -> contextlib.AbstractContextManager:
+        """Times the body of a with statement into the histogram with the given name."""
+        if not self.enabled:
+            return _null_context
+        return self._timer(name, labels)
+
+    @contextlib.contextmanager
+    def _event(self, name: str, labels: dict[str, str]) -> Iterator[None]:
+        calls = [0]
+        token = _rest_calls.set(calls)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+            self.observe(f"{name}_rest_calls", calls[0], COUNT_BUCKETS, **labels)
+            _rest_calls.reset(token)
+
+    def event(self, name: str, **labels: str) -> contextlib.AbstractContextManager:
+        """
+        Times the handling of an event like timer does, and also records how many REST calls were made while
+        handling it. Only calls made through an HTTP client passed to count_rest_calls are counted.
+        """
+        if not self.enabled:
+            return _null_context
+        return self._event(name, labels)
+
+    def count_rest_calls(self, http):
+        """Wraps the request method of a discord.py HTTP client, so that its calls are counted."""
+        if not self.enabled:
+            return
+
+        request = http.request
+
+        async def counted_request(route, **kwargs):
+            self.increment("rest_calls_total", method=route.method)
+            calls = _rest_calls.get()
+            if calls is not None:
+                calls[0] += 1
+            return await request(route, **kwargs)
+
+        http.request = counted_request
+
+    async def watch_loop_lag(self, interval: float = 1.0):
+        """Measures how late the event loop wakes up from a sleep, forever."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe("event_loop_lag_seconds", max(time.perf_counter() - start - interval, 0.0))
+
+    def histograms(self) -> dict[tuple[str, Labels], Histogram]:
+        return dict(self._histograms)
+
+    def gauges(self) -> dict[str, float]:
+        return {name: callback() for name, callback in self._gauges.items()}
+
+    def render(self) -> str:
+        """Returns every metric in the Prometheus text format."""
+        def format_labels(labels: Labels, extra: str = "") -> str:
+            parts = [f'{key}="{value}"' for key, value in labels]
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        lines = []
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, callback in sorted(self._gauges.items()):
+            lines.append(f"{name} {callback()}")
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels, f'le="{bound}"')} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels, 'le="+Inf"')} {histogram.count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port: int) -> web.AppRunner:
+        """Serves the metrics on http://127.0.0.1:<port>/metrics."""
+        async def handle_metrics(request: web.Request) -> web.Response:
+            return web.Response(text=self.render())
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
@@ -0,0 +1,119 @@
+import re
+from fractions import Fraction
+from xml.etree import ElementTree
+
+# Times on Nintendo Switch Online are multiplied by this to get the time on original hardware, since NSO runs the
+# game at 60 fps rather than the GBA's 59.7275
+NSO_FACTOR = Fraction(60) / Fraction("59.7275")
+_factor_numerator = NSO_FACTOR.numerator
+_factor_denominator = NSO_FACTOR.denominator
+_double_denominator = 2 * NSO_FACTOR.denominator
+
+# Times are handled as whole ticks of 100 ns, the resolution LiveSplit saves times with, so that no precision is lost
+TICKS_PER_SECOND = 10 ** 7
+TICK_DIGITS = 7
+
+# [hours:]minutes:seconds[.fraction], as typed by people, who don't always pad seconds to two digits
+_time = re.compile(r"(?<![\d:.])(?:(\d+):)?(\d+):(\d{1,2})(?:\.(\d+))?(?![\d:])")
+# An element of a splits file holding a time as [days.]hours:minutes:seconds[.fraction], which is how every split,
+# best segment and attempt is saved
+_lss_time = re.compile(r"<(RealTime|GameTime)>(-)?(?:(\d+)\.)?(\d+):(\d\d):(\d\d)(?:\.(\d+))?</\1>")
+
+
+def _fraction_ticks(fraction: str | None) -> int:
+    if not fraction:
+        return 0
+    if len(fraction) == TICK_DIGITS:
+        return int(fraction)
+    # Anything past the 7th digit is rounded away, like LiveSplit does
+    ticks = int(fraction[:TICK_DIGITS].ljust(TICK_DIGITS, "0"))
+    if len(fraction) > TICK_DIGITS and fraction[TICK_DIGITS] >= "5":
+        ticks += 1
+    return ticks
+
+
+def _ticks(hours: str | None, minutes: str, seconds: str, fraction: str | None) -> int:
+    total_seconds = (int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)
+    return total_seconds * TICKS_PER_SECOND + _fraction_ticks(fraction)
+
+
+def _digits(fraction: str | None) -> int:
+    # Converted times are shown as precisely as they were given, with at least hundredths
+    return min(max(len(fraction or ""), 2), TICK_DIGITS)
+
+
+def parse_time(text: str) -> tuple[int, int]:
+    """
+    Parses [hours:]minutes:seconds[.fraction] into ticks, along with how many digits to show it with. Raises a
+    ValueError if it's not a time.
+    """
+    match = _time.fullmatch(text.strip())
+    if match is None:
+        raise ValueError(f"{text} is not a time")
+    return _ticks(*match.groups()), _digits(match[4])
+
+
+def to_original_hardware(ticks: int) -> int:
+    """Converts a time on NSO to the time on original hardware, rounded to the nearest tick."""
+    # Rounds half up, without ever going through a float
+    return (2 * ticks * _factor_numerator + _factor_denominator) // _double_denominator
+
+
+def format_time(ticks: int, digits: int = 2) -> str:
+    """Formats ticks as hours:minutes:seconds with the given number of digits after the point, rounded half up."""
+    unit = 10 ** (TICK_DIGITS - digits)
+    rounded = (ticks + unit // 2) // unit
+    seconds, fraction = divmod(rounded, 10 ** digits)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    text = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    return f"{text}.{fraction:0{digits}d}" if digits else text
+
+
+def contains_time(text: str) -> bool:
+    return _time.search(text) is not None
+
+
+def convert_times_in_text(text: str) -> str:
+    """Replaces every time in the text, like a pasted list of splits, with its time on original hardware."""
+    return _time.sub(lambda match: format_time(to_original_hardware(_ticks(*match.groups())), _digits(match[4])),
+                     text)
+
+
+def _convert_lss_time(match: re.Match) -> str:
+    # Called for every time in the file, so this does what _ticks, to_original_hardware and format_time do inline
+    tag, negative, days, hours, minutes, seconds, fraction = match.groups()
+    ticks = ((int(days or 0) * 24 + int(hours)) * 3600 + int(minutes) * 60 + int(seconds)) * TICKS_PER_SECOND
+    ticks = (2 * (ticks + _fraction_ticks(fraction)) * _factor_numerator + _factor_denominator) // _double_denominator
+
+    seconds, fraction = divmod(ticks, TICKS_PER_SECOND)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    # %-formatting is about twice as fast as an f-string with format specs here
+    return "<%s>%s%s%02d:%02d:%02d.%07d</%s>" % (tag, negative or "", f"{days}." if days else "", hours, minutes,
+                                                 seconds, fraction, tag)
+
+
+def convert_lss(data: bytes) -> bytes:
+    """
+    Converts every time in a LiveSplit splits file from NSO to original hardware: the split times, best segments
+    and the times of every attempt. Everything else in the file is kept exactly as it was. Raises a ValueError if
+    it's not a splits file.
+    """
+    # Only the start of the file is parsed to check what it is, the times are replaced right in the text, which is a
+    # lot faster than going through every element and writing them all back out
+    parser = ElementTree.XMLPullParser(events=("start",))
+    root = None
+    try:
+        for offset in range(0, len(data), 4096):
+            parser.feed(data[offset:offset + 4096])
+            root = next((element for _, element in parser.read_events()), None)
+            if root is not None:
+                break
+    except ElementTree.ParseError as e:
+        raise ValueError(f"Not a splits file: {e}")
+    if root is None or root.tag != "Run":
+        raise ValueError("Not a splits file: it has no run")
+
+    return _lss_time.sub(_convert_lss_time, data.decode("utf-8")).encode("utf-8")
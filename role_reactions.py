@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+class RoleUpdateQueue:
+    """
+    Collects role changes for members and applies them together. The first change for a member waits delay seconds
+    for more to come in, then only the roles that end up different from before are added or removed, so quickly
+    toggled reactions cost nothing if they cancel out. Roles are added and removed one by one rather than by setting
+    the member's whole role list, so roles given in the meantime by anyone else are never taken away. Edits in the
+    same guild are made one at a time, since they share a rate limit bucket.
+    """
+
+    def __init__(self, delay: float = 2.0):
+        self.delay = delay
+        # Pending changes by (guild id, member id), as the member and whether they had and should have each role
+        self._pending: dict[tuple[int, int], tuple[discord.Member, dict[int, tuple[bool, bool]]]] = {}
+        self._guild_locks: dict[int, asyncio.Lock] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.requested = 0
+        self.edits = 0
+
+    def request(self, member: discord.Member, role_id: int, add: bool):
+        """Asks for the role to be added to or removed from the member. Later requests for the same role win."""
+        self.requested += 1
+        key = (member.guild.id, member.id)
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = (member, {})
+            task = asyncio.create_task(self._apply_later(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        _, roles = pending
+        # Whether the member had the role is only taken from the first request for it, later member objects may not
+        # include changes that are still being applied
+        had = roles[role_id][0] if role_id in roles else member.get_role(role_id) is not None
+        roles[role_id] = (had, add)
+
+    async def _apply_later(self, key: tuple[int, int]):
+        await asyncio.sleep(self.delay)
+
+        lock = self._guild_locks.setdefault(key[0], asyncio.Lock())
+        async with lock:
+            # The member stays pending until every change is made, so anything requested while waiting for the lock
+            # or for an edit is merged in and applied by this loop
+            member, roles = self._pending[key]
+            while changes := {role_id: add for role_id, (had, add) in roles.items() if had != add}:
+                for role_id, add in changes.items():
+                    self.edits += 1
+                    try:
+                        if add:
+                            await member.add_roles(discord.Object(id=role_id))
+                        else:
+                            await member.remove_roles(discord.Object(id=role_id))
+                    except discord.HTTPException as e:
+                        log.warning("Could not update the roles of %s: %s", member, e)
+                    roles[role_id] = (add, roles[role_id][1])
+            del self._pending[key]
+
+    @property
+    def depth(self) -> int:
+        """The number of members with changes waiting to be applied."""
+        return len(self._pending)
+
+    @property
+    def merge_ratio(self) -> float:
+        """How many requests were made per edit."""
+        return self.requested / self.edits if self.edits else 0.0
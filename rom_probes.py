@@ -0,0 +1,178 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import Any
+
+import mars_patcher.constants.game_data as mars_game_data
+from mars_patcher.rom import Rom
+
+# Ranges closer together than this are read as one
+MERGE_GAP = 128
+
+
+class SpanReader:
+    """Serves reads from a few spans of a ROM that were read up front."""
+
+    def __init__(self, rom: Rom, spans: list[tuple[int, int]]):
+        self.rom = rom
+        self._starts = [start for start, _ in spans]
+        self._data = [bytes(rom.read_bytes(start, length)) for start, length in spans]
+        self.decoded: dict[Any, Any] = {}
+
+    def read(self, offset: int, length: int) -> bytes:
+        index = bisect_right(self._starts, offset) - 1
+        if index >= 0:
+            start = self._starts[index]
+            data = self._data[index]
+            if offset + length <= start + len(data):
+                return data[offset - start:offset - start + length]
+        raise ValueError(f"{length} bytes at {offset} weren't read by any probe")
+
+
+class Probe(ABC):
+    """A check on the contents of a ROM. ranges lists every (offset, length) that evaluate is going to read."""
+
+    @abstractmethod
+    def ranges(self, rom: Rom) -> list[tuple[int, int]]:
+        pass
+
+    @abstractmethod
+    def evaluate(self, reader: SpanReader) -> Any:
+        pass
+
+
+@dataclass(frozen=True)
+class Matches(Probe):
+    """The bytes at offset are exactly expected."""
+    offset: int
+    expected: bytes
+
+    def ranges(self, rom: Rom) -> list[tuple[int, int]]:
+        return [(self.offset, len(self.expected))]
+
+    def evaluate(self, reader: SpanReader) -> bool:
+        return reader.read(self.offset, len(self.expected)) == self.expected
+
+
+@dataclass(frozen=True)
+class StridedMatches(Probe):
+    """Taking width bytes every stride bytes count times, starting at offset, gives exactly expected."""
+    offset: int
+    stride: int
+    width: int
+    count: int
+    expected: bytes
+
+    def ranges(self, rom: Rom) -> list[tuple[int, int]]:
+        return [(self.offset, self.stride * (self.count - 1) + self.width)]
+
+    def evaluate(self, reader: SpanReader) -> bool:
+        span = reader.read(*self.ranges(reader.rom)[0])
+        return b"".join(span[index * self.stride:index * self.stride + self.width]
+                        for index in range(self.count)) == self.expected
+
+
+@dataclass(frozen=True)
+class U16Equals(Probe):
+    """The little endian 16-bit value at offset is expected."""
+    offset: int
+    expected: int
+
+    def ranges(self, rom: Rom) -> list[tuple[int, int]]:
+        return [(self.offset, 2)]
+
+    def evaluate(self, reader: SpanReader) -> bool:
+        return int.from_bytes(reader.read(self.offset, 2), "little") == self.expected
+
+
+@dataclass(frozen=True)
+class JoinedBytesEqual(Probe):
+    """The bytes at offsets, written as decimal numbers and joined together, read as expected."""
+    offsets: tuple[int, ...]
+    expected: str
+
+    def ranges(self, rom: Rom) -> list[tuple[int, int]]:
+        return [(offset, 1) for offset in self.offsets]
+
+    def evaluate(self, reader: SpanReader) -> bool:
+        return "".join(str(reader.read(offset, 1)[0]) for offset in self.offsets) == self.expected
+
+
+@dataclass(frozen=True)
+class StringsIn(Probe):
+    """
+    The null terminated ASCII strings at offsets, without the whitespace around them, are all in allowed. Every
+    string is read from a slot of slot_length bytes, and isn't allowed if it doesn't end in there.
+    """
+    offsets: tuple[int, ...]
+    allowed: frozenset[str]
+    slot_length: int
+
+    def ranges(self, rom: Rom) -> list[tuple[int, int]]:
+        # Strings padded with whitespace can be longer than anything allowed, so the whole slot is read
+        return [(offset, self.slot_length) for offset in self.offsets]
+
+    def evaluate(self, reader: SpanReader) -> bool:
+        for offset in self.offsets:
+            data = reader.read(offset, self.slot_length)
+            end = data.find(b"\x00")
+            if end == -1:
+                return False
+            if data[:end].decode("ascii", errors="replace").strip() not in self.allowed:
+                return False
+        return True
+
+
+@dataclass(frozen=True)
+class AreaConnectionsEqual(Probe):
+    """The area connection table leads from the given (area, door) pairs to the expected areas."""
+    doors: tuple[tuple[int, int], ...]
+    expected: tuple[int, ...]
+
+    def ranges(self, rom: Rom) -> list[tuple[int, int]]:
+        # The table ends with an entry of FFs
+        return [(mars_game_data.area_connections(rom), (mars_game_data.area_connections_count(rom) + 1) * 3)]
+
+    def evaluate(self, reader: SpanReader) -> bool:
+        # Shared by every probe on the table, so it's only decoded once
+        connections = reader.decoded.get(AreaConnectionsEqual)
+        if connections is None:
+            table = reader.read(*self.ranges(reader.rom)[0])
+            connections = {}
+            for index in range(0, len(table), 3):
+                source_area, source_door, target_area = table[index:index + 3]
+                connections[(source_area, source_door)] = target_area
+                if source_area == 255:
+                    break
+            reader.decoded[AreaConnectionsEqual] = connections
+
+        return tuple(connections.get(door) for door in self.doors) == self.expected
+
+
+class ProbeTable:
+    """
+    Evaluates a table of named probes on a ROM. The ranges every probe needs are merged into a few spans, which are
+    read once per ROM before any probe runs. Negated probes report the opposite of what they check.
+    """
+
+    def __init__(self, rows: list[tuple[str, Probe, bool]]):
+        self.rows = rows
+        self._spans: dict[Any, list[tuple[int, int]]] = {}
+
+    def spans(self, rom: Rom) -> list[tuple[int, int]]:
+        key = (rom.game, rom.region)
+        if key not in self._spans:
+            ranges = sorted(rng for _, probe, _ in self.rows for rng in probe.ranges(rom))
+            spans = []
+            for start, length in ranges:
+                if spans and start <= spans[-1][0] + spans[-1][1] + MERGE_GAP:
+                    last_start, last_length = spans[-1]
+                    spans[-1] = (last_start, max(last_length, start + length - last_start))
+                else:
+                    spans.append((start, length))
+            self._spans[key] = spans
+        return self._spans[key]
+
+    def run(self, rom: Rom) -> dict[str, Any]:
+        reader = SpanReader(rom, self.spans(rom))
+        return {name: probe.evaluate(reader) != negate for name, probe, negate in self.rows}
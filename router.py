@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+from discord import Message
+
+from metrics import Metrics
+
+Handler = Callable[[Message], Awaitable[None]]
+Predicate = Callable[[Message], bool]
+
+log = logging.getLogger(__name__)
+
+
+class MessageRouter:
+    """
+    Sends messages only to the handlers that care about them. Handlers are indexed by the attachment extensions
+    they're registered for, and can further filter messages with a predicate. Handlers registered without extensions
+    get every message.
+    All handlers for a message run concurrently, and an exception in one doesn't affect the others. If metrics are
+    given, every handler run is recorded as a handler event.
+    """
+
+    def __init__(self, metrics: Metrics | None = None):
+        self.metrics = metrics or Metrics(enabled=False)
+        self._by_extension: dict[str, list[tuple[Handler, Predicate | None]]] = {}
+        self._always: list[tuple[Handler, Predicate | None]] = []
+
+    def route(self, extensions: list[str] | None = None,
+              predicate: Predicate | None = None) -> Callable[[Handler], Handler]:
+        """
+        Registers the decorated handler for messages with an attachment with one of the given extensions, that also
+        pass the predicate if there is one.
+        """
+        def decorator(handler: Handler) -> Handler:
+            entry = (handler, predicate)
+            if extensions:
+                for extension in extensions:
+                    self._by_extension.setdefault(extension.lower(), []).append(entry)
+            else:
+                self._always.append(entry)
+            return handler
+
+        return decorator
+
+    def handlers_for(self, message: Message) -> list[Handler]:
+        candidates = list(self._always)
+        for attachment in message.attachments:
+            candidates += self._by_extension.get(os.path.splitext(attachment.filename)[1].lower(), [])
+
+        handlers = []
+        for handler, predicate in candidates:
+            if handler not in handlers and (predicate is None or predicate(message)):
+                handlers.append(handler)
+        return handlers
+
+    async def _run(self, handler: Handler, message: Message):
+        try:
+            with self.metrics.event("handler", handler=handler.__name__):
+                await handler(message)
+        except Exception:
+            log.exception("Handler %s failed for message %s", handler.__name__, message.id)
+
+    async def dispatch(self, message: Message):
+        handlers = self.handlers_for(message)
+        if len(handlers) == 1:
+            await self._run(handlers[0], message)
+        elif handlers:
+            await asyncio.gather(*(self._run(handler, message) for handler in handlers))
@@ -0,0 +1,164 @@
+from bisect import bisect_right
+from zlib import crc32
+
+SOURCE_READ = 0
+TARGET_READ = 1
+SOURCE_COPY = 2
+TARGET_COPY = 3
+
+
+class SparseBpsTarget:
+    """
+    The output of a BPS patch that is never built in full. The action stream is read once to index which part of the
+    source, the patch or the earlier output every range of the target comes from, and single reads are resolved on
+    demand. Supports indexing and slicing like the bytearray a Rom normally holds.
+
+    Raises a ValueError if the patch is malformed or not made for the given source. The target checksum can't be
+    checked without building the target, so it's the only part of the patch that isn't verified.
+    """
+
+    def __init__(self, patch: bytes, source: bytes | memoryview, source_crc32: int | None = None):
+        self.patch = patch
+        self.source = source
+        self._patch_idx = 0
+        # Start offset of every action in the target, with the kind of action and where its data comes from
+        self._starts: list[int] = []
+        self._actions: list[tuple[int, int]] = []
+        self._index(source_crc32)
+
+    def _error(self, msg: str):
+        raise ValueError(f"Invalid BPS file: {msg}")
+
+    def _decode_int(self) -> int:
+        patch = self.patch
+        idx = self._patch_idx
+        num = 0
+        shift = 1
+        while True:
+            if idx >= len(patch):
+                self._error("unexpected end of patch")
+            x = patch[idx]
+            idx += 1
+            num += (x & 0x7F) * shift
+            if x & 0x80 != 0:
+                self._patch_idx = idx
+                return num
+            shift <<= 7
+            num += shift
+
+    def _index(self, source_crc32: int | None):
+        patch = self.patch
+        if patch[:4] != b"BPS1":
+            self._error("missing marker")
+        self._patch_idx = 4
+        source_size = self._decode_int()
+        target_size = self._decode_int()
+        metadata_size = self._decode_int()
+        self._patch_idx += metadata_size
+
+        footer_start = len(patch) - 12
+        if footer_start < self._patch_idx:
+            self._error("patch is too short")
+        if source_size != len(self.source):
+            self._error("source size doesn't match")
+        if int.from_bytes(patch[footer_start + 8:], "little") != crc32(memoryview(patch)[:-4]):
+            self._error("patch checksum doesn't match")
+        if source_crc32 is None:
+            source_crc32 = crc32(self.source)
+        if int.from_bytes(patch[footer_start:footer_start + 4], "little") != source_crc32:
+            self._error("source checksum doesn't match")
+
+        output_offset = 0
+        source_offset = 0
+        target_offset = 0
+        while self._patch_idx < footer_start:
+            num = self._decode_int()
+            length = (num >> 2) + 1
+            action = num & 3
+            if output_offset + length > target_size:
+                self._error("action writes past the end of the target")
+
+            if action == SOURCE_READ:
+                if output_offset + length > source_size:
+                    self._error("source read past the end of the source")
+                arg = output_offset
+            elif action == TARGET_READ:
+                arg = self._patch_idx
+                self._patch_idx += length
+            elif action == SOURCE_COPY:
+                offset = self._decode_int()
+                source_offset += (-1 if offset & 1 else 1) * (offset >> 1)
+                if source_offset < 0 or source_offset + length > source_size:
+                    self._error("source copy outside of the source")
+                arg = source_offset
+                source_offset += length
+            else:
+                offset = self._decode_int()
+                target_offset += (-1 if offset & 1 else 1) * (offset >> 1)
+                if target_offset < 0 or target_offset >= output_offset:
+                    self._error("target copy from data that wasn't written yet")
+                arg = target_offset
+                target_offset += length
+
+            self._starts.append(output_offset)
+            self._actions.append((action, arg))
+            output_offset += length
+
+        if self._patch_idx != footer_start:
+            self._error("actions run into the footer")
+        if output_offset != target_size:
+            self._error("actions don't fill the target")
+        self._size = target_size
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _locate(self, addr: int) -> tuple[int, int, int, int]:
+        """Returns the start, end, kind and source argument of the action that wrote the given address."""
+        index = bisect_right(self._starts, addr) - 1
+        start = self._starts[index]
+        end = self._starts[index + 1] if index + 1 < len(self._starts) else self._size
+        action, arg = self._actions[index]
+        return start, end, action, arg
+
+    def _read_byte(self, addr: int) -> int:
+        while True:
+            start, _, action, arg = self._locate(addr)
+            if action == SOURCE_READ:
+                return self.source[addr]
+            if action == TARGET_READ:
+                return self.patch[arg + addr - start]
+            if action == SOURCE_COPY:
+                return self.source[arg + addr - start]
+            # Target copies may overlap what they write, in which case they repeat every (start - arg) bytes
+            addr = arg + (addr - start) % (start - arg)
+
+    def __getitem__(self, key: int | slice) -> int | bytes:
+        if isinstance(key, slice):
+            first, last, step = key.indices(self._size)
+            if step != 1:
+                return bytes(self[addr] for addr in range(first, last, step))
+            return self._read_range(first, last)
+
+        if key < 0:
+            key += self._size
+        if not 0 <= key < self._size:
+            raise IndexError("index out of range")
+        return self._read_byte(key)
+
+    def _read_range(self, first: int, last: int) -> bytes:
+        result = bytearray()
+        addr = first
+        while addr < last:
+            start, end, action, arg = self._locate(addr)
+            end = min(end, last)
+            if action == SOURCE_READ:
+                result += self.source[addr:end]
+            elif action == TARGET_READ:
+                result += self.patch[arg + addr - start:arg + end - start]
+            elif action == SOURCE_COPY:
+                result += self.source[arg + addr - start:arg + end - start]
+            else:
+                result += bytes(self._read_byte(target_addr) for target_addr in range(addr, end))
+            addr = end
+        return bytes(result)
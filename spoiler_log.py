@@ -0,0 +1,109 @@
+import json
+import re
+import sqlite3
+
+# Tank counts are left out of the summary since they're rarely changed
+HIDDEN_SETTINGS = ["E-Tanks", "Missile Tanks", "Power Bomb Tanks"]
+SUMMARY_KEYS = ["MFOR Version", "Seed", "Settings", "Item order"]
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+
+def load_top_level_keys(data: bytes, keys: list[str]) -> dict:
+    """
+    Parses only the given keys of a JSON object. Parsing stops as soon as all of them were found, and every other
+    value is discarded right after it's read instead of being kept along with the rest of the document.
+    The parser isn't incremental: the whole document is decoded to a string first, so peak memory is still about
+    twice the size of the data while it runs, more if it's mostly non-ASCII text.
+    """
+    # json can only scan strings, and skipping values byte by byte in Python would be many times slower
+    text = data.decode("utf-8")
+    idx = _whitespace.match(text, 0).end()
+    if text[idx:idx + 1] != "{":
+        raise ValueError("Expected a JSON object")
+    idx += 1
+
+    wanted = set(keys)
+    found = {}
+    while wanted:
+        idx = _whitespace.match(text, idx).end()
+        if text[idx:idx + 1] == "}":
+            break
+        if text[idx:idx + 1] != '"':
+            raise ValueError(f"Expected a key at position {idx}")
+        key, idx = json.decoder.scanstring(text, idx + 1)
+        idx = _whitespace.match(text, idx).end()
+        if text[idx:idx + 1] != ":":
+            raise ValueError(f"Expected ':' at position {idx}")
+        value, idx = _decoder.raw_decode(text, _whitespace.match(text, idx + 1).end())
+        if key in wanted:
+            found[key] = value
+            wanted.discard(key)
+        idx = _whitespace.match(text, idx).end()
+        if text[idx:idx + 1] == ",":
+            idx += 1
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        raise KeyError(missing[0])
+    return found
+
+
+def summarize_spoiler_log(data: bytes) -> dict:
+    """Returns the parts of an MFOR spoiler log that the bot shows, as plain JSON serializable data."""
+    spoiler = load_top_level_keys(data, SUMMARY_KEYS)
+    return {
+        "version": spoiler["MFOR Version"],
+        "seed": spoiler["Seed"],
+        "settings": {key: value for key, value in spoiler["Settings"].items() if key not in HIDDEN_SETTINGS},
+        "item_order": [[location, item] for location, item in spoiler["Item order"].items()],
+    }
+
+
+def render_item_order(item_order: list[list[str]], spoilered: bool, page_length: int = 2000) -> list[str]:
+    """Renders the item order as messages that each fit into page_length characters."""
+    spoiler_char = "||" if spoilered else ""
+    pages = []
+    page = "Item Order:"
+    for index, (location, item) in enumerate(item_order):
+        line = f"{index}. {spoiler_char}{item} at {location}{spoiler_char}"
+        if len(page) + 1 + len(line) > page_length:
+            pages.append(page)
+            page = line
+        else:
+            page += "\n" + line
+    pages.append(page)
+    return pages
+
+
+class ItemOrderStore:
+    """
+    Keeps the rendered item order of every spoiler log the bot replied to in an SQLite database, keyed by the id of
+    the reply and the position of the spoiler log in it, so its buttons keep working across restarts without keeping
+    any spoiler logs in memory.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS spoiler_item_orders "
+                         "(message_id INTEGER NOT NULL, position INTEGER NOT NULL, spoilered TEXT NOT NULL, "
+                         "revealed TEXT NOT NULL, PRIMARY KEY (message_id, position))")
+        self._db.commit()
+
+    def put(self, message_id: int, position: int, item_order: list[list[str]]):
+        self._db.execute("INSERT OR REPLACE INTO spoiler_item_orders (message_id, position, spoilered, revealed) "
+                         "VALUES (?, ?, ?, ?)",
+                         (message_id, position, json.dumps(render_item_order(item_order, True)),
+                          json.dumps(render_item_order(item_order, False))))
+        self._db.commit()
+
+    def get(self, message_id: int, position: int, spoilered: bool) -> list[str] | None:
+        """Returns the rendered pages of an item order in the reply with the given id, if there is one."""
+        column = "spoilered" if spoilered else "revealed"
+        row = self._db.execute(f"SELECT {column} FROM spoiler_item_orders WHERE message_id = ? AND position = ?",
+                               (message_id, position)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def close(self):
+        self._db.close()
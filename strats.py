@@ -0,0 +1,132 @@
+import re
+import sqlite3
+from dataclasses import dataclass
+
+# Only this many of the newest matches are ranked, which keeps searches for very common words fast
+RANKED_MATCHES = 500
+# How the add command posts strats, which is also how they're read back from the channel history
+_post_format = re.compile(r"\[(?P<name>.+)\]\((?P<link>\S+)\), in (?P<location>.+) for (?P<category>.+) by "
+                          r"(?P<author>.+)")
+_filter_format = re.compile(r"\b(location|category):", re.IGNORECASE)
+_word = re.compile(r"\w+")
+
+
+@dataclass(frozen=True)
+class Strat:
+    link: str
+    name: str
+    location: str
+    category: str
+    author: str
+
+    def post(self) -> str:
+        return f"[{self.name}]({self.link}), in {self.location} for {self.category} by {self.author}"
+
+    @staticmethod
+    def from_post(content: str) -> "Strat | None":
+        """Reads a strat back from a post in the strats channel, or returns None if it isn't one."""
+        match = _post_format.fullmatch(content.strip())
+        if match is None:
+            return None
+        return Strat(match["link"], match["name"], match["location"], match["category"], match["author"])
+
+
+def parse_strat_search(text: str) -> tuple[str, str, str]:
+    """Splits "<words> location: <words> category: <words>" into the words, location and category, in any order."""
+    parts = _filter_format.split(text)
+    filters = {"location": "", "category": ""}
+    for index in range(1, len(parts) - 1, 2):
+        filters[parts[index].lower()] = parts[index + 1].strip()
+    return parts[0].strip(), filters["location"], filters["category"]
+
+
+def _match_expression(text: str, column: str | None = None) -> str:
+    # Every word has to be in the strat. Quoting the words keeps anything the user typed from being read as FTS syntax.
+    # Search words are matched as prefixes so that partial words still find something, filters only by whole words,
+    # since prefixes of common words like "sector" are a lot slower to match.
+    words = " AND ".join(f'"{word}"' if column else f'"{word}"*' for word in _word.findall(text))
+    if not words:
+        return ""
+    return f"{column} : ({words})" if column else f"({words})"
+
+
+class StratCatalog:
+    """
+    Every strat added with the add command, in an SQLite database with a full text index over the name, location,
+    category and author, so they can be searched without going through the channel history.
+    Strats are kept per server, along with how far the history of its strats channel has been read into the catalog.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS strats "
+                         "(id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, message_id INTEGER UNIQUE, "
+                         "link TEXT NOT NULL, name TEXT NOT NULL, location TEXT NOT NULL, category TEXT NOT NULL, "
+                         "author TEXT NOT NULL)")
+        # Indexes the strats table rather than keeping its own copy of the text
+        self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS strats_fts USING fts5 "
+                         "(name, location, category, author, content='strats', content_rowid='id', "
+                         "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        self._db.execute("CREATE TABLE IF NOT EXISTS strat_backfills "
+                         "(guild_id INTEGER PRIMARY KEY, last_message_id INTEGER, done INTEGER NOT NULL)")
+        self._db.commit()
+
+    def _insert(self, guild_id: int, message_id: int | None, strat: Strat) -> bool:
+        cursor = self._db.execute("INSERT OR IGNORE INTO strats "
+                                  "(guild_id, message_id, link, name, location, category, author) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  (guild_id, message_id, strat.link, strat.name, strat.location, strat.category,
+                                   strat.author))
+        if cursor.rowcount == 0:
+            # Already in the catalog
+            return False
+        self._db.execute("INSERT INTO strats_fts (rowid, name, location, category, author) VALUES (?, ?, ?, ?, ?)",
+                         (cursor.lastrowid, strat.name, strat.location, strat.category, strat.author))
+        return True
+
+    def add(self, guild_id: int, message_id: int | None, strat: Strat) -> bool:
+        """Adds a strat posted as the message with the given id. Returns False if that post was already added."""
+        with self._db:
+            return self._insert(guild_id, message_id, strat)
+
+    def add_backfilled(self, guild_id: int, posts: list[tuple[int, Strat]], last_message_id: int, done: bool) -> int:
+        """
+        Adds a batch of (message id, strat) read from the history of the strats channel, and records that the history
+        was read up to last_message_id. Returns how many of them weren't in the catalog yet.
+        """
+        with self._db:
+            added = sum(self._insert(guild_id, message_id, strat) for message_id, strat in posts)
+            self._db.execute("INSERT OR REPLACE INTO strat_backfills (guild_id, last_message_id, done) "
+                             "VALUES (?, ?, ?)", (guild_id, last_message_id, done))
+        return added
+
+    def backfill_progress(self, guild_id: int) -> tuple[int | None, bool]:
+        """Returns the id of the last message read from the strats channel history, and whether all of it was read."""
+        row = self._db.execute("SELECT last_message_id, done FROM strat_backfills WHERE guild_id = ?",
+                               (guild_id,)).fetchone()
+        if row is None:
+            return None, False
+        return row[0], bool(row[1])
+
+    def search(self, guild_id: int, query: str, location: str = "", category: str = "", limit: int = 5) -> list[Strat]:
+        """
+        Returns up to limit strats with every word of the query, best matches first. Words in the name count the most,
+        then the location, category and author. Location and category only match strats with those whole words in
+        them. If there are a lot of matches, only the newest ones are ranked.
+        """
+        expressions = [expression for expression in (_match_expression(query),
+                                                     _match_expression(location, "location"),
+                                                     _match_expression(category, "category")) if expression]
+        if not expressions:
+            return []
+
+        rows = self._db.execute("SELECT link, name, location, category, author FROM "
+                                "(SELECT strats.*, bm25(strats_fts, 10.0, 5.0, 2.0, 1.0) AS score "
+                                "FROM strats_fts JOIN strats ON strats.id = strats_fts.rowid "
+                                "WHERE strats_fts MATCH ? AND strats.guild_id = ? ORDER BY strats_fts.rowid DESC "
+                                "LIMIT ?) ORDER BY score LIMIT ?",
+                                (" AND ".join(expressions), guild_id, RANKED_MATCHES, limit)).fetchall()
+        return [Strat(*row) for row in rows]
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,50 @@
+import logging
+import os
+from abc import ABC, abstractmethod
+
+log = logging.getLogger(__name__)
+
+
+def _stat_key(path: str | os.PathLike[str]) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class WatchedFile(ABC):
+    """
+    Base for data loaded from a file, which is loaded again whenever the file changes on disk so that it can be
+    edited while the bot runs. Subclasses read the file in load and call _reload_if_changed before using what they
+    loaded.
+    """
+
+    # What the file holds, for the message logged when it can't be reloaded
+    description = "data"
+
+    def __init__(self, path: str | os.PathLike[str]):
+        self.path = path
+        self._loaded_key: tuple[int, int] | None = None
+
+    @abstractmethod
+    def load(self):
+        """Reads the file. Raises an OSError or ValueError if it can't be used."""
+
+    def reload(self):
+        """Reads the file now, raising whatever load raises."""
+        key = _stat_key(self.path)
+        self.load()
+        self._loaded_key = key
+
+    def _reload_if_changed(self):
+        key = _stat_key(self.path)
+        if key is None or key == self._loaded_key:
+            return
+
+        try:
+            self.load()
+        except (OSError, ValueError, TypeError) as e:
+            # Keep the last good data until the file is fixed
+            log.warning("Could not reload %s, keeping the previous %s: %s", self.path, self.description, e)
+        self._loaded_key = key
@@ -0,0 +1,173 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from enemies import EnemyIndex
+
+# The colors of X in x_chances, and what picking up one of each restores
+X_COLORS = ("yellow", "green", "red")
+X_ENERGY = np.array([10, 0, 30])
+X_MISSILES = np.array([0, 2, 5])
+
+DEFAULT_TRIALS = 10 ** 6
+# Kills of one enemy are simulated all at once, from a table with every possible outcome of that many kills, which grows
+# with the cube of the count
+MAX_KILLS_PER_ENEMY = 100
+MAX_ROUTE_LENGTH = 20
+# How much memory outcome tables are kept in, the largest take about 2.7 MiB
+OUTCOME_CACHE_BYTES = 32 * 1024 * 1024
+
+# Draws are whole numbers below this, as fine grained as a random double
+DRAW_RANGE = 2 ** 53
+_PACK_SHIFT = 32
+_PACK_MASK = 2 ** _PACK_SHIFT - 1
+
+_target_format = re.compile(r"\b(energy|missiles):\s*(\d+)", re.IGNORECASE)
+_kill_format = re.compile(r"(?P<name>.+?)(?:\s+[x×*]\s*(?P<count>\d+))?")
+
+
+@dataclass(frozen=True)
+class XDropResult:
+    trials: int
+    # Energy and missiles restored in every trial
+    energy: np.ndarray
+    missiles: np.ndarray
+
+    def chance_of(self, energy: int = 0, missiles: int = 0) -> float:
+        """Returns the chance of getting at least the given energy and missiles."""
+        return float(np.count_nonzero((self.energy >= energy) & (self.missiles >= missiles))) / self.trials
+
+
+def describe_amounts(amounts: np.ndarray) -> tuple[float, int, int, int, int]:
+    """Returns the average, 5th percentile, median, 95th percentile and highest of the amounts restored in each run."""
+    low, median, high = np.percentile(amounts, [5, 50, 95], method="inverted_cdf")
+    return float(amounts.mean()), int(low), int(median), int(high), int(amounts.max())
+
+
+def parse_route(text: str) -> tuple[list[tuple[str, int]], int, int]:
+    """
+    Splits "<enemy> x<count>, <enemy> x<count> energy: <amount> missiles: <amount>" into the (enemy, count) kills and
+    the targets. Counts default to 1 and targets to 0.
+    """
+    targets = {"energy": 0, "missiles": 0}
+    for match in _target_format.finditer(text):
+        targets[match[1].lower()] = int(match[2])
+
+    kills = []
+    for part in _target_format.sub("", text).split(","):
+        part = part.strip().lower()
+        if not part:
+            continue
+        match = _kill_format.fullmatch(part)
+        kills.append((match["name"], int(match["count"] or 1)))
+    return kills, targets["energy"], targets["missiles"]
+
+
+def _outcomes(chances: tuple[float, float, float, float], count: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns every possible outcome of killing an enemy count times, as the thresholds that a uniform draw below
+    DRAW_RANGE has to be under for each outcome, and the energy and missiles each of them restores, packed together.
+    """
+    # Every way to split the kills into yellow, green, red and no X. Small integers keep the grid of candidates, which
+    # is several times larger than the table, from taking up much memory.
+    yellow, green, red = np.indices((count + 1,) * 3, dtype=np.int16).reshape(3, -1)
+    possible = yellow + green + red <= count
+    counts = np.stack([yellow[possible], green[possible], red[possible]])
+    counts = np.vstack([counts, count - counts.sum(axis=0)])
+
+    # Multinomial probabilities, worked out in logs so that they don't overflow
+    log_factorials = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, count + 1)))])
+    log_probabilities = log_factorials[count] - log_factorials[counts].sum(axis=0)
+    with np.errstate(divide="ignore"):
+        log_chances = np.log(np.array(chances))
+    for color, log_chance in enumerate(log_chances):
+        if log_chance == -np.inf:
+            # Outcomes with an X that never drops can't happen
+            log_probabilities[counts[color] > 0] = -np.inf
+        else:
+            log_probabilities += counts[color] * log_chance
+    probabilities = np.exp(log_probabilities)
+    counts = counts[:, probabilities > 0]
+
+    # Searching integers is several times faster than searching floats
+    cumulative = np.cumsum(probabilities[probabilities > 0])
+    thresholds = (cumulative / cumulative[-1] * DRAW_RANGE).astype(np.int64)
+    # Makes sure every draw lands on an outcome, even if the sum rounded to just under 1
+    thresholds[-1] = DRAW_RANGE
+    packed = (X_ENERGY @ counts[:3]) << _PACK_SHIFT | X_MISSILES @ counts[:3]
+    return thresholds, packed
+
+
+class XDropSimulator:
+    """
+    Simulates the X that enemies drop over a route. The drop chances of every enemy are read from the enemy info once
+    and kept until it changes.
+    """
+
+    def __init__(self, enemy_index: EnemyIndex, seed: int | None = None):
+        self.enemy_index = enemy_index
+        self._rng = np.random.default_rng(seed)
+        self._enemies = None
+        self._chances: dict[str, tuple[float, float, float, float]] = {}
+        # Outcome tables by (chances, count), least recently used first
+        self._outcomes: OrderedDict[tuple[tuple[float, float, float, float], int], tuple[np.ndarray, np.ndarray]] = \
+            OrderedDict()
+        self._outcome_bytes = 0
+        self._outcomes_lock = threading.Lock()
+
+    def chances(self, enemy: str) -> tuple[float, float, float, float] | None:
+        """Returns the chances of a kill dropping a yellow, green, red or no X, or None if they aren't known."""
+        enemies = self.enemy_index.all()
+        if enemies is not self._enemies:
+            self._chances = {}
+            for name, info in enemies.items():
+                x_chances = info.get("x_chances")
+                if x_chances is not None:
+                    drops = tuple(float(x_chances.get(color, 0.0)) for color in X_COLORS)
+                    self._chances[name] = drops + (max(1.0 - math.fsum(drops), 0.0),)
+            self._enemies = enemies
+        return self._chances.get(enemy)
+
+    def _outcome_table(self, chances: tuple[float, float, float, float], count: int) -> tuple[np.ndarray, np.ndarray]:
+        key = (chances, count)
+        # Simulations run in threads. Tables are also built under the lock, so that only one is built at a time.
+        with self._outcomes_lock:
+            table = self._outcomes.get(key)
+            if table is not None:
+                self._outcomes.move_to_end(key)
+                return table
+
+            table = _outcomes(chances, count)
+            self._outcomes[key] = table
+            self._outcome_bytes += sum(array.nbytes for array in table)
+            while self._outcome_bytes > OUTCOME_CACHE_BYTES and len(self._outcomes) > 1:
+                _, evicted = self._outcomes.popitem(last=False)
+                self._outcome_bytes -= sum(array.nbytes for array in evicted)
+            return table
+
+    def simulate(self, kills: list[tuple[str, int]], trials: int = DEFAULT_TRIALS) -> XDropResult:
+        """
+        Simulates killing every (enemy, count) in kills trials times. Enemies have to be given by their name rather
+        than an alias. Raises a ValueError for enemies without drop chances or too many kills.
+        """
+        if len(kills) > MAX_ROUTE_LENGTH:
+            raise ValueError(f"Routes can have at most {MAX_ROUTE_LENGTH} enemies")
+
+        # Energy and missiles are added up together, with the energy in the high bits
+        packed = np.zeros(trials, dtype=np.int64)
+        for enemy, count in kills:
+            chances = self.chances(enemy)
+            if chances is None:
+                raise ValueError(f"There's no X drop data for {enemy}")
+            if not 0 < count <= MAX_KILLS_PER_ENEMY:
+                raise ValueError(f"Enemies can be killed 1 to {MAX_KILLS_PER_ENEMY} times")
+
+            thresholds, outcome_packed = self._outcome_table(chances, count)
+            outcome = np.searchsorted(thresholds, self._rng.integers(0, DRAW_RANGE, trials), side="right")
+            packed += outcome_packed[outcome]
+
+        return XDropResult(trials, packed >> _PACK_SHIFT, packed & _PACK_MASK)